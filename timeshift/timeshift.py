@@ -7,15 +7,18 @@
 
 import sys
 import os
-import base64
-import sqlite3 as sql
-import pathlib
+import time
+import threading
+
+# Process start time for the startup time measurement.
+startupBeginTime = time.perf_counter()
 
 try:
 	raise ImportError #FIXME
 	from PySide2.QtCore import *
 	from PySide2.QtGui import *
 	from PySide2.QtWidgets import *
+	pyqtSignal, pyqtSlot = Signal, Slot
 	usingPySide = True
 except ImportError as e:
 	from PyQt5.QtCore import *
@@ -23,249 +26,97 @@ except ImportError as e:
 	from PyQt5.QtWidgets import *
 	usingPySide = False
 
-isAndroid = any("ANDROID" in k.upper() for k in os.environ.keys())
-
-# Shift types
-SHIFT_DEFAULT		= -1 # (not DB ABI)
-SHIFT_EARLY		= 0
-SHIFT_LATE		= 1
-SHIFT_NIGHT		= 2
-SHIFT_DAY		= 3
-
-# Day type overrides
-DTYPE_DEFAULT		= 0 # (not DB ABI)
-DTYPE_COMPTIME		= 1
-DTYPE_HOLIDAY		= 2
-DTYPE_FEASTDAY		= 3
-DTYPE_SHORTTIME		= 4
+from tscore import *
 
-# Day flags
-DFLAG_UNCERTAIN		= (1 << 0)
-DFLAG_ATTENDANT		= (1 << 1)
+registerDateType(QDate, QDate.fromJulianDay)
 
-
-def toBase64(string):
-	return base64.standard_b64encode(
-		string.encode("UTF-8", "ignore")).decode("UTF-8", "ignore")
-
-def fromBase64(b64str):
-	return base64.standard_b64decode(
-		b64str.encode("UTF-8", "ignore")).decode("UTF-8", "ignore")
+isAndroid = any("ANDROID" in k.upper() for k in os.environ.keys())
 
 class Wrapper(object): # Must not be QObject derived.
 	__slots__ = ( "obj", )
 	def __init__(self, obj):
 		self.obj = obj
 
-def floatEqual(f0, f1):
-	return abs(f0 - f1) < 0.001
-
-def QDateToId(qdate):
-	"""Convert a QDate object to a unique integer ID."""
-	return QDateTime(qdate).toMSecsSinceEpoch()
+class GuiDatabase(TsDatabase):
+	"""Database with a Qt timer driven delayed commit."""
 
-def IdToQDate(idNum):
-	"""Convert a unique integer ID to a QDate object."""
-	return QDateTime.fromMSecsSinceEpoch(int(idNum)).date()
+	def __init__(self):
+		self.commitTimer = QTimer()
+		self.commitTimer.setSingleShot(True)
+		self.commitTimer.timeout.connect(self.__commitTimerTimeout)
+		self.worker = None
+		TsDatabase.__init__(self)
 
-class TsException(Exception): pass
+	def __commitTimerTimeout(self):
+		if self.worker:
+			self.worker.requestCommit()
+			return
+		print("Committing database...")
+		self.commit()
 
-class ICal_Event(QObject):
-	def __init__(self):
-		QObject.__init__(self)
-		self.props = { }
+	def startCommitTimer(self, msec):
+		self.commitTimer.start(msec)
 
-	def addProp(self, prop):
-		self.props[prop.name] = prop
+class BackgroundWorker(QObject):
+	"""Runs database commits and account calculations
+	in a background thread. Pending requests are coalesced:
+	Only the latest account calculation request and
+	one commit are processed. Results are posted as signals."""
 
-	def getProp(self, name):
-		try:
-			return self.props[name]
-		except KeyError as e:
-			return None
+	# (date, AccountState or None)
+	accountStateReady = pyqtSignal(object, object)
 
-	def getDateRange(self):
-		# Returns a list of QDate objects
-		start = self.getProp("DTSTART")
-		if not start:
-			raise TsException("No DTSTART property")
-		end = self.getProp("DTEND")
-		if not end:
-			dur = self.getProp("DURATION")
-			if not dur:
-				return [ start.toQDate() ]
-			raise TsException("TODO: DURATION property "
-				"not implemented, yet.")
-		ret, date = [], start.toQDate()
-		while date < end.toQDate():
-			ret.append(date)
-			date = date.addDays(1)
-		return ret
-
-class ICal_Prop(QObject):
-	def __init__(self, name, params, value):
-		QObject.__init__(self)
-		self.name = name
-		self.params = params
-		self.value = value
-
-	def toQDate(self):
-		date = QDate.fromString(self.value, Qt.ISODate)
-		if date.isValid():
-			return date
-		date = QDate.fromString(self.value, "yyyyMMdd")
-		if date.isValid():
-			return date
-		raise TsException("Date property '%s' "
-			"format error" % self.name)
-
-class ICal(QObject):
-	"Simple iCalendar parser"
+	__requestPosted = pyqtSignal()
 
-	def __init__(self):
-#		QObject.__init__(self)
-		pass
-
-	def getEvents(self):
-		return self.__events
-
-	def __parseParams(self, params):
-		# Returns a list of tuples: (paramName, paramValue)
-		ret = []
-		for param in params:
-			p = param.split('=')
-			if len(p) != 2:
-				raise TsException("Invalid parameter '%s'" % param)
-			p[0] = p[0].upper()
-			ret.append(tuple(p))
-		return ret
-
-	def __unknown(self, propName, value):
-		print("ical: Ignoring unexpected '%s:%s'" %\
-		      (propName, value))
-
-	def parseICal(self, data):
-		self.__events = []
-		inCalendar = False
-		curEvent = None
-		for line in data.splitlines():
-			if not line.strip():
-				continue
-			vstart = line.find(':')
-			value = line[vstart+1:]
-			prop = line[:vstart].split(';')
-			propName = prop[0].strip().upper()
-			try:
-				propParams = prop[1:]
-			except IndexError as e:
-				propParams = []
-			propParams = self.__parseParams(propParams)
-			if not inCalendar:
-				if propName == "BEGIN" and\
-				   value.strip().upper() == "VCALENDAR":
-					inCalendar = True
-					continue
-				self.__unknown(propName, value)
-				continue
-			if not curEvent:
-				if propName in ("METHOD", "PRODID", "VERSION"):
-					continue
-				if propName == "BEGIN" and\
-				   value.strip().upper() == "VEVENT":
-					curEvent = ICal_Event()
-					continue
-				if propName == "END" and\
-				   value.strip().upper() == "VCALENDAR":
-					curEvent = None
-					inCalendar = False
-					continue
-				self.__unknown(propName, value)
-				continue
-			if propName == "END" and\
-			   value.strip().upper() == "VEVENT":
-				self.__events.append(curEvent)
-				curEvent = None
-				continue
-			curEvent.addProp(ICal_Prop(propName, propParams, value))
-
-class ICalImport_Opts(QObject):
-	def __init__(self, setShift, setDayType):
+	def __init__(self, db, account):
 		QObject.__init__(self)
-		self.setShift = setShift
-		self.setDayType = setDayType
-
-class ICalImport(ICal):
-	def __init__(self, widget, db):
-		ICal.__init__(self)
-		self.widget = widget
 		self.db = db
+		self.account = account
+		self.__lock = threading.Lock()
+		self.__accountRequest = None
+		self.__commitRequest = False
+		self.__thread = QThread()
+		self.moveToThread(self.__thread)
+		self.__requestPosted.connect(self.__process)
+		self.__thread.start()
+
+	def stop(self):
+		self.__thread.quit()
+		self.__thread.wait()
+
+	def requestCommit(self):
+		with self.__lock:
+			self.__commitRequest = True
+		self.__requestPosted.emit()
+
+	def requestAccountState(self, date):
+		with self.__lock:
+			self.__accountRequest = QDate(date)
+		self.__requestPosted.emit()
+
+	@pyqtSlot()
+	def __process(self):
+		# Runs in the worker thread.
+		with self.__lock:
+			date, self.__accountRequest = self.__accountRequest, None
+			commit, self.__commitRequest = self.__commitRequest, False
+		try:
+			if date is not None:
+				with self.db.operation("accountState"):
+					state = self.account.calcAccountStateForDate(date)
+				self.accountStateReady.emit(date, state)
+			if commit:
+				print("Committing database...")
+				with self.db.operation("commit"):
+					self.db.commit()
+		except TsException as e:
+			print("Background worker: " + str(e))
 
-	def importICal(self, data, opts):
-		self.parseICal(data)
-		for event in self.getEvents():
-			summary = event.getProp("SUMMARY")
-			if not summary:
-				raise TsException(
-					"Event does not have SUMMARY attribute")
-			for date in event.getDateRange():
-				self.__doImport(event, date, opts)
-
-	def __doImport(self, event, date, opts):
-		if opts.setDayType != DTYPE_DEFAULT:
-			newDType = opts.setDayType
-			curDType = self.db.getDayTypeOverride(date)
-			if curDType is not None and\
-			   curDType != newDType:
-				yes = self.__question(date,
-					"Has day-type override",
-					date.toString() + ": "
-					"Already has day type. Override?")
-				if not yes:
-					newDType = curDType
-			if curDType != newDType:
-				self.db.setDayTypeOverride(date, newDType)
-		if opts.setShift != SHIFT_DEFAULT:
-			newShift = opts.setShift
-			curShift = self.db.getShiftOverride(date)
-			if curShift is not None and\
-			   curShift != newShift:
-				yes = self.__question(date,
-					"Has shift override",
-					date.toString() + ": "
-					"Already has shift. Override?")
-				if not yes:
-					newShift = curShift
-			if curShift != newShift:
-				self.db.setShiftOverride(date, newShift)
-		summary = event.getProp("SUMMARY").value
-		newComment = summary
-		curComment = self.db.getComment(date)
-		if curComment and\
-		   curComment != newComment:
-			yes = self.__question(date, "Comment exists",
-				"A comment exists:\n'" + curComment +\
-				"'\n\nAppend '%s'?" % summary)
-			if yes:
-				newComment = curComment + '\n' + summary
-			else:
-				newComment = curComment
-		if curComment != newComment:
-			self.db.setComment(date, newComment)
-
-	def __question(self, date, caption, text):
-		res = QMessageBox.question(self.widget,
-			date.toString() + ": " + caption,
-			text,
-			QMessageBox.Yes | QMessageBox.No |\
-			QMessageBox.Cancel)
-		if res & QMessageBox.Cancel:
-			raise TsException("Cancelled")
-		return bool(res & QMessageBox.Yes)
-
-class ICalImportDialog(QDialog, ICalImport):
+class ICalImportDialog(QDialog):
 	def __init__(self, parent, db):
 		QDialog.__init__(self, parent)
-		ICalImport.__init__(self, self, db)
+		import tsical
+		self.importer = tsical.ICalImport(db, question=self.__question)
 
 		self.setWindowTitle("iCalendar Import")
 		self.setLayout(QGridLayout())
@@ -297,22 +148,30 @@ class ICalImportDialog(QDialog, ICalImport):
 		self.__fileImport(fn)
 		self.accept()
 
+	def __question(self, date, caption, text):
+		# Ask the user about conflicts with existing data.
+		res = QMessageBox.question(self,
+			date.toString() + ": " + caption,
+			text,
+			QMessageBox.Yes | QMessageBox.No |\
+			QMessageBox.Cancel)
+		if res & QMessageBox.Cancel:
+			raise TsException("Cancelled")
+		return bool(res & QMessageBox.Yes)
+
 	def __fileImport(self, filename):
-		try:
-			fd = open(filename, "rb")
-			data = fd.read().decode("UTF-8")
-			fd.close()
-		except (IOError, UnicodeError) as e:
-			QMessageBox.critical(self,
-				"iCal Laden fehlgeschlagen",
-				"Laden fehlgeschlagen:\n" + str(e))
-			return
-		opts = ICalImport_Opts(
+		import tsical
+		opts = tsical.ICalImport_Opts(
 			setShift=self.shiftCombo.selectedShift(),
 			setDayType=self.typeCombo.selectedDayType()
 		)
 		try:
-			self.importICal(data, opts)
+			with open(filename, "rb") as fd:
+				self.importer.importICal(fd, opts)
+		except IOError as e:
+			QMessageBox.critical(self,
+				"iCal Laden fehlgeschlagen",
+				"Laden fehlgeschlagen:\n" + str(e))
 		except TsException as e:
 			QMessageBox.critical(self,
 				"iCal Import fehlgeschlagen",
@@ -344,595 +203,6 @@ class ShiftComboBox(QComboBox):
 	def selectedShift(self):
 		return self.itemData(self.currentIndex())
 
-class ShiftConfigItem(QObject):
-	def __init__(self, name, shift, workTime, breakTime, attendanceTime):
-		QObject.__init__(self)
-		self.name = name
-		self.shift = shift
-		self.workTime = workTime
-		self.breakTime = breakTime
-		self.attendanceTime = attendanceTime
-
-	@staticmethod
-	def toBytes(item):
-		return ";".join(
-			(	toBase64(item.name),
-				str(item.shift),
-				str(item.workTime),
-				str(item.breakTime),
-				str(item.attendanceTime),
-			)
-		).encode("UTF-8", "ignore")
-
-	@staticmethod
-	def fromBytes(b):
-		string = b.decode("UTF-8", "ignore")
-		elems = string.split(";")
-		try:
-			return ShiftConfigItem(
-				fromBase64(elems[0]),
-				int(elems[1], 10),
-				float(elems[2]),
-				float(elems[3]),
-				float(elems[4])
-			)
-		except (IndexError, ValueError) as e:
-			raise TsException("ShiftConfigItem.fromBytes() "
-					  "invalid string: " + string)
-
-class Preset(QObject):
-	def __init__(self, name, dayType, shift, workTime, breakTime, attendanceTime):
-		QObject.__init__(self)
-		self.name = name
-		self.dayType = dayType
-		self.shift = shift
-		self.workTime = workTime
-		self.breakTime = breakTime
-		self.attendanceTime = attendanceTime
-
-	@staticmethod
-	def toBytes(preset):
-		return ";".join(
-			(	toBase64(preset.name),
-				str(preset.dayType),
-				str(preset.shift),
-				str(preset.workTime),
-				str(preset.breakTime),
-				str(preset.attendanceTime),
-			)
-		).encode("UTF-8", "ignore")
-
-	@staticmethod
-	def fromBytes(b):
-		string = b.decode("UTF-8", "ignore")
-		elems = string.split(";")
-		try:
-			return Preset(
-				fromBase64(elems[0]),
-				int(elems[1], 10),
-				int(elems[2], 10),
-				float(elems[3]),
-				float(elems[4]),
-				float(elems[5])
-			)
-		except (IndexError, ValueError) as e:
-			raise TsException("Preset.fromBytes() "
-					  "invalid string: " + string)
-
-class Snapshot(QObject):
-	def __init__(self, date, shiftConfigIndex, accountValue,
-		     holidaysLeft):
-		QObject.__init__(self)
-		self.date = date
-		self.shiftConfigIndex = shiftConfigIndex
-		self.accountValue = accountValue
-		self.holidaysLeft = holidaysLeft
-
-	@staticmethod
-	def toBytes(snapshot):
-		return ";".join(
-			(	str(QDateToId(snapshot.date)),
-				str(snapshot.shiftConfigIndex),
-				str(snapshot.accountValue),
-				str(snapshot.holidaysLeft),
-			)
-		).encode("UTF-8", "ignore")
-
-	@staticmethod
-	def fromBytes(b):
-		string = b.decode("UTF-8", "ignore")
-		elems = string.split(";")
-		try:
-			return Snapshot(
-				IdToQDate(int(elems[0], 10)),
-				int(elems[1], 10),
-				float(elems[2]),
-				int(elems[3], 10)
-			)
-		except (IndexError, ValueError) as e:
-			raise TsException("Snapshot.fromBytes() "
-					  "invalid string: " + string)
-
-class TsDatabase(QObject):
-	INMEM		= ":memory:"
-	VERSION		= 2
-	COMPAT_VERSIONS	= ( 2, )
-
-	sql.register_adapter(QDate, QDateToId)
-	sql.register_converter("QDate", IdToQDate)
-
-	sql.register_adapter(ShiftConfigItem, ShiftConfigItem.toBytes)
-	sql.register_converter("ShiftConfigItem", ShiftConfigItem.fromBytes)
-
-	sql.register_adapter(Preset, Preset.toBytes)
-	sql.register_converter("Preset", Preset.fromBytes)
-
-	sql.register_adapter(Snapshot, Snapshot.toBytes)
-	sql.register_converter("Snapshot", Snapshot.fromBytes)
-
-	TAB_params	= "params(name TEXT, data TEXT)"
-	TAB_dayflags	= "dayFlags(date QDate, value INTEGER)"
-	TAB_ovr_daytype	= "override_dayType(date QDate, value TEXT)"
-	TAB_ovr_shift	= "override_shift(date QDate, value TEXT)"
-	TAB_ovr_worktm	= "override_workTime(date QDate, value TEXT)"
-	TAB_ovr_brtm	= "override_breakTime(date QDate, value TEXT)"
-	TAB_ovr_atttm	= "override_attendanceTime(date QDate, value TEXT)"
-	TAB_snaps	= "snapshots(date QDate, snapshot Snapshot)"
-	TAB_comments	= "comments(date QDate, comment TEXT)"
-	TAB_shconf	= "shiftConfig(idx INTEGER, item ShiftConfigItem)"
-	TAB_presets	= "presets(idx INTEGER, preset Preset)"
-
-	def __init__(self):
-		QObject.__init__(self)
-		self.commitTimer = QTimer(self)
-		self.commitTimer.setSingleShot(True)
-		self.commitTimer.timeout.connect(self.__commitTimerTimeout)
-		self.__reset()
-		self.open(self.INMEM)
-
-	def __del__(self):
-		self.conn.close()
-
-	def __sqlError(self, exception):
-		msg = "SQL error: " + str(exception)
-		print(msg)
-		import traceback
-		traceback.print_stack()
-		raise TsException(msg)
-
-	def __reset(self):
-		self.conn = None
-		self.filename = None
-		self.cachedShiftConfig = None
-
-	def __close(self):
-		if not self.conn:
-			return
-		try:
-			if not self.isInMemory():
-				print("Closing database...")
-				self.commit()
-				self.conn.cursor().execute("VACUUM;")
-				self.commit()
-			self.conn.close()
-			self.__reset()
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def close(self):
-		self.__close()
-		self.open(self.INMEM)
-
-	def open(self, filename):
-		try:
-			self.__close()
-			self.conn = sql.connect(str(filename),
-				detect_types=sql.PARSE_DECLTYPES)
-			self.filename = filename
-			if not self.isInMemory():
-				self.__checkDatabaseVersion()
-			self.__initTables(self.conn)
-			if self.isInMemory():
-				self.__setDatabaseVersion()
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def __setDatabaseVersion(self):
-		try:
-			self.__setParameter("dbVersion", self.VERSION)
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def __checkDatabaseVersion(self):
-		try:
-			dbVer = int(self.__getParameter("dbVersion"), 10)
-			if dbVer not in self.COMPAT_VERSIONS:
-				raise TsException("Unsupported database "
-					"version v%d" % dbVer)
-		except sql.Error as e:
-			self.__sqlError(e)
-		except ValueError as e:
-			raise TsException("Invalid database version info")
-
-	def getFilename(self):
-		return self.filename
-
-	def isInMemory(self):
-		return self.filename == self.INMEM
-
-	def commit(self):
-		try:
-			self.conn.commit()
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def __commitTimerTimeout(self):
-		print("Committing database...")
-		self.commit()
-
-	def scheduleCommit(self, msec=5000):
-		self.commitTimer.start(msec)
-
-	def __initTables(self, conn):
-		script = (
-			"CREATE TABLE IF NOT EXISTS %s;" % self.TAB_params,
-			"CREATE TABLE IF NOT EXISTS %s;" % self.TAB_dayflags,
-			"CREATE TABLE IF NOT EXISTS %s;" % self.TAB_ovr_daytype,
-			"CREATE TABLE IF NOT EXISTS %s;" % self.TAB_ovr_shift,
-			"CREATE TABLE IF NOT EXISTS %s;" % self.TAB_ovr_worktm,
-			"CREATE TABLE IF NOT EXISTS %s;" % self.TAB_ovr_brtm,
-			"CREATE TABLE IF NOT EXISTS %s;" % self.TAB_ovr_atttm,
-			"CREATE TABLE IF NOT EXISTS %s;" % self.TAB_snaps,
-			"CREATE TABLE IF NOT EXISTS %s;" % self.TAB_comments,
-			"CREATE TABLE IF NOT EXISTS %s;" % self.TAB_shconf,
-			"CREATE TABLE IF NOT EXISTS %s;" % self.TAB_presets,
-		)
-		conn.cursor().executescript("\n".join(script))
-		conn.commit()
-
-	def resetDatabase(self):
-		self.conn.cursor().executescript("""
-			DROP TABLE IF EXISTS params;
-			DROP TABLE IF EXISTS dayFlags;
-			DROP TABLE IF EXISTS override_dayType;
-			DROP TABLE IF EXISTS override_shift;
-			DROP TABLE IF EXISTS override_workTime;
-			DROP TABLE IF EXISTS override_breakTime;
-			DROP TABLE IF EXISTS override_attendanceTime;
-			DROP TABLE IF EXISTS snapshots;
-			DROP TABLE IF EXISTS comments;
-			DROP TABLE IF EXISTS shiftConfig;
-			DROP TABLE IF EXISTS presets;
-		""")
-		self.conn.commit()
-		self.conn.cursor().execute("VACUUM;")
-		self.conn.commit()
-		self.__initTables(self.conn)
-		self.__setDatabaseVersion()
-		self.conn.commit()
-
-	def __cloneTab(self, sourceCursor, targetCursor, tabSignature):
-		tabName = tabSignature.split("(")[0].strip()
-		columns = tabSignature.split("(")[1].split(")")[0]
-		columns = [ c.split()[0] for c in columns.split(",") ]
-		columns = ", ".join(columns)
-		targetCursor.execute("DROP TABLE IF EXISTS %s;" % tabName)
-		targetCursor.execute("CREATE TABLE %s;" % tabSignature)
-		sourceCursor.execute("SELECT %s FROM %s;" % (columns, tabName))
-		for rowData in sourceCursor.fetchall():
-			valTmpl = ", ".join("?" * len(columns.split(",")))
-			targetCursor.execute("INSERT INTO %s(%s) VALUES(%s);" %\
-				(tabName, columns, valTmpl),
-				rowData)
-
-	def clone(self, target):
-		try:
-			cloneconn = sql.connect(str(target),
-				detect_types=sql.PARSE_DECLTYPES)
-			for tabSignature in (self.TAB_params, self.TAB_dayflags,
-					     self.TAB_ovr_daytype, self.TAB_ovr_shift,
-					     self.TAB_ovr_worktm, self.TAB_ovr_brtm,
-					     self.TAB_ovr_atttm, self.TAB_snaps,
-					     self.TAB_comments, self.TAB_shconf,
-					     self.TAB_presets):
-				self.__cloneTab(sourceCursor=self.conn.cursor(),
-						targetCursor=cloneconn.cursor(),
-						tabSignature=tabSignature)
-			cloneconn.commit()
-			cloneconn.cursor().execute("VACUUM;")
-			cloneconn.commit()
-			cloneconn.close()
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def __setParameter(self, param, value):
-		try:
-			c = self.conn.cursor()
-			c.execute("DELETE FROM params WHERE name=?;", (str(param),))
-			if value is not None:
-				c.execute("INSERT INTO params(name, data) VALUES(?, ?);",
-					  (str(param), str(value)))
-			self.scheduleCommit()
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def __getParameter(self, param):
-		try:
-			c = self.conn.cursor()
-			c.execute("SELECT data FROM params WHERE name=?;", (param,))
-			value = c.fetchone()
-			if value:
-				return value[0]
-			return None
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def setDayFlags(self, date, value):
-		try:
-			c = self.conn.cursor()
-			c.execute("DELETE FROM dayFlags WHERE date=?;", (date,))
-			c.execute("INSERT INTO dayFlags(date, value) VALUES(?, ?);",
-				  (date, int(value) & 0xFFFFFFFF))
-			self.scheduleCommit()
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def getDayFlags(self, date):
-		try:
-			c = self.conn.cursor()
-			c.execute("SELECT value FROM dayFlags WHERE date=?;", (date,))
-			value = c.fetchone()
-			if not value:
-				return 0
-			return int(value[0]) & 0xFFFFFFFF
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def __setOverride(self, table, date, value):
-		try:
-			c = self.conn.cursor()
-			c.execute("DELETE FROM %s WHERE date=?;" % table, (date,))
-			if value is not None:
-				c.execute("INSERT INTO %s(date, value) VALUES(?, ?);" % table,
-					  (date, str(value)))
-			self.scheduleCommit()
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def __getOverride(self, table, date):
-		try:
-			c = self.conn.cursor()
-			c.execute("SELECT value FROM %s WHERE date=?;" % table, (date,))
-			value = c.fetchone()
-			if value:
-				return value[0]
-			return None
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def __hasOverride(self, table, date):
-		try:
-			c = self.conn.cursor()
-			c.execute("SELECT COUNT(*) FROM %s WHERE date=?;" % table, (date,))
-			value = c.fetchone()
-			if value:
-				return value[0] > 0
-			return False
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def setDayTypeOverride(self, date, daytype):
-		self.__setOverride("override_dayType", date, daytype)
-
-	def hasDayTypeOverride(self, date):
-		return self.__hasOverride("override_dayType", date)
-
-	def getDayTypeOverride(self, date):
-		try:
-			return int(self.__getOverride("override_dayType", date), 10)
-		except (ValueError, TypeError) as e:
-			return None
-
-	def findDayTypeDates(self, daytype, beginDate, endDate):
-		# Find all dates with the specified "daytype" between
-		# "beginDate" and "endDate".
-		# XXX: Currently unused.
-		try:
-			c = self.conn.cursor()
-			c.execute("""
-				SELECT date FROM override_dayType WHERE
-				(value=? AND date>=? AND date<=?);
-			""", (daytype, beginDate, endDate))
-			dates = c.fetchall()
-			return [ d[0] for d in dates ]
-		except (ValueError, TypeError) as e:
-			return None
-
-	def setShiftOverride(self, date, shift):
-		self.__setOverride("override_shift", date, shift)
-
-	def hasShiftOverride(self, date):
-		return self.__hasOverride("override_shift", date)
-
-	def getShiftOverride(self, date):
-		try:
-			return int(self.__getOverride("override_shift", date), 10)
-		except (ValueError, TypeError) as e:
-			return None
-
-	def setWorkTimeOverride(self, date, workTime):
-		self.__setOverride("override_workTime", date, workTime)
-
-	def hasWorkTimeOverride(self, date):
-		return self.__hasOverride("override_workTime", date)
-
-	def getWorkTimeOverride(self, date):
-		try:
-			return float(self.__getOverride("override_workTime", date))
-		except (ValueError, TypeError) as e:
-			return None
-
-	def setBreakTimeOverride(self, date, breakTime):
-		self.__setOverride("override_breakTime", date, breakTime)
-
-	def hasBreakTimeOverride(self, date):
-		return self.__hasOverride("override_breakTime", date)
-
-	def getBreakTimeOverride(self, date):
-		try:
-			return float(self.__getOverride("override_breakTime", date))
-		except (ValueError, TypeError) as e:
-			return None
-
-	def setAttendanceTimeOverride(self, date, attendanceTime):
-		self.__setOverride("override_attendanceTime", date, attendanceTime)
-
-	def hasAttendanceTimeOverride(self, date):
-		return self.__hasOverride("override_attendanceTime", date)
-
-	def getAttendanceTimeOverride(self, date):
-		try:
-			return float(self.__getOverride("override_attendanceTime", date))
-		except (ValueError, TypeError) as e:
-			return None
-
-	def setShiftConfigItems(self, items):
-		self.cachedShiftConfig = items
-		try:
-			c = self.conn.cursor()
-			c.execute("DROP TABLE IF EXISTS shiftConfig;")
-			c.execute("CREATE TABLE %s;" % self.TAB_shconf)
-			for (index, item) in enumerate(items):
-				c.execute("INSERT INTO shiftConfig(idx, item) VALUES(?, ?);",
-					  (index, item))
-			self.scheduleCommit()
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def getShiftConfigItems(self):
-		if self.cachedShiftConfig is not None:
-			return self.cachedShiftConfig
-		try:
-			c = self.conn.cursor()
-			c.execute("CREATE TABLE IF NOT EXISTS %s;" % self.TAB_shconf)
-			c.execute('SELECT item FROM shiftConfig ORDER BY "idx";')
-			items = c.fetchall()
-			items = [ i[0] for i in items ]
-			self.cachedShiftConfig = items
-			return items
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def setPresets(self, presets):
-		try:
-			c = self.conn.cursor()
-			c.execute("DROP TABLE IF EXISTS presets;")
-			c.execute("CREATE TABLE %s;" % self.TAB_presets)
-			for (index, preset) in enumerate(presets):
-				c.execute("INSERT INTO presets(idx, preset) VALUES(?, ?);",
-					  (index, preset))
-			self.scheduleCommit()
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def getPresets(self):
-		try:
-			c = self.conn.cursor()
-			c.execute("CREATE TABLE IF NOT EXISTS %s;" % self.TAB_presets)
-			c.execute('SELECT preset FROM presets ORDER BY "idx";')
-			presets = c.fetchall()
-			return [ p[0] for p in presets ]
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def setSnapshot(self, date, snapshot):
-		try:
-			c = self.conn.cursor()
-			c.execute("DELETE FROM snapshots WHERE date=?;", (date,))
-			if snapshot is not None:
-				c.execute("INSERT INTO snapshots(date, snapshot) VALUES(?, ?);",
-					  (date, snapshot))
-			self.scheduleCommit()
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def hasSnapshot(self, date):
-		try:
-			c = self.conn.cursor()
-			c.execute("SELECT COUNT(*) FROM snapshots WHERE date=?;", (date,))
-			value = c.fetchone()
-			if value:
-				return value[0] > 0
-			return False
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def getSnapshot(self, date):
-		try:
-			c = self.conn.cursor()
-			c.execute("SELECT snapshot FROM snapshots WHERE date=?;", (date,))
-			snapshot = c.fetchone()
-			if snapshot:
-				snapshot = snapshot[0]
-			return snapshot
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def getAllSnapshots(self):
-		try:
-			c = self.conn.cursor()
-			c.execute("SELECT snapshot FROM snapshots;")
-			snapshots = c.fetchall()
-			return [ s[0] for s in snapshots ]
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def findSnapshotForDate(self, date):
-		# Get the snapshot that is active for a certain date.
-		try:
-			c = self.conn.cursor()
-			c.execute("SELECT snapshot FROM snapshots WHERE date<=? "
-				  "ORDER BY date DESC", (date,))
-			snapshot = c.fetchone()
-			if snapshot:
-				return snapshot[0]
-			return None
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def setComment(self, date, comment):
-		try:
-			c = self.conn.cursor()
-			c.execute("DELETE FROM comments WHERE date=?;", (date,))
-			if comment:
-				c.execute("INSERT INTO comments(date, comment) VALUES(?, ?);",
-					  (date, str(comment)))
-			self.scheduleCommit()
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def hasComment(self, date):
-		try:
-			c = self.conn.cursor()
-			c.execute("SELECT COUNT(*) FROM comments WHERE date=?;", (date,))
-			value = c.fetchone()
-			if value:
-				return value[0] > 0
-			return False
-		except sql.Error as e:
-			self.__sqlError(e)
-
-	def getComment(self, date):
-		try:
-			c = self.conn.cursor()
-			c.execute("SELECT comment FROM comments WHERE date=?;", (date,))
-			comment = c.fetchone()
-			if comment:
-				comment = comment[0]
-			return comment
-		except sql.Error as e:
-			self.__sqlError(e)
-
 class TimeSpinBox(QWidget):
 	def __init__(self, parent, val=0.0, minVal=0.0, maxVal=24.0,
 		     step=0.1, decimals=2, prefix=None, suffix="h"):
@@ -1192,21 +462,22 @@ class EnhancedDialog(QDialog):
 	def commit(self):
 		date = self.mainWidget.calendar.selectedDate()
 
-		dayFlags = oldDayFlags = self.mainWidget.getDayFlags(date)
-		for checkBox, flag in ((self.uncertainCheckBox, DFLAG_UNCERTAIN),
-				       (self.attendantCheckBox, DFLAG_ATTENDANT)):
-			dayFlags &= ~flag
-			dayFlags |= flag if checkBox.checkState() == Qt.Checked else 0
-		if dayFlags != oldDayFlags:
-			self.mainWidget.setDayFlags(date, dayFlags)
-			if dayFlags & DFLAG_ATTENDANT:
-				# Automatically reset day type, if attendant flag was set.
-				self.mainWidget.setDayType(date, DTYPE_DEFAULT)
-
-		old = self.mainWidget.getCommentFor(date)
-		new = self.comment.document().toPlainText()
-		if old != new:
-			self.mainWidget.setCommentFor(date, new)
+		with self.mainWidget.db.batch():
+			dayFlags = oldDayFlags = self.mainWidget.getDayFlags(date)
+			for checkBox, flag in ((self.uncertainCheckBox, DFLAG_UNCERTAIN),
+					       (self.attendantCheckBox, DFLAG_ATTENDANT)):
+				dayFlags &= ~flag
+				dayFlags |= flag if checkBox.checkState() == Qt.Checked else 0
+			if dayFlags != oldDayFlags:
+				self.mainWidget.setDayFlags(date, dayFlags)
+				if dayFlags & DFLAG_ATTENDANT:
+					# Automatically reset day type, if attendant flag was set.
+					self.mainWidget.setDayType(date, DTYPE_DEFAULT)
+
+			old = self.mainWidget.getCommentFor(date)
+			new = self.comment.document().toPlainText()
+			if old != new:
+				self.mainWidget.setCommentFor(date, new)
 
 		self.mainWidget.recalculate()
 
@@ -1239,10 +510,41 @@ class ManageDialog(QDialog):
 		self.fileGroup.layout().addWidget(self.icalButton, 3, 0)
 		self.icalButton.released.connect(self.icalImport)
 
+		self.icalExportButton = QPushButton("iCalendar export", self)
+		self.fileGroup.layout().addWidget(self.icalExportButton, 4, 0)
+		self.icalExportButton.released.connect(self.icalExport)
+
+		self.saveCopyButton = QPushButton("Kopie speichern unter", self)
+		self.fileGroup.layout().addWidget(self.saveCopyButton, 5, 0)
+		self.saveCopyButton.released.connect(self.saveDatabaseCopy)
+
+		self.backupButton = QPushButton("Sicherung erstellen", self)
+		self.fileGroup.layout().addWidget(self.backupButton, 6, 0)
+		self.backupButton.released.connect(self.backupDatabase)
+		self.backupButton.setEnabled(not mainWidget.db.isInMemory())
+
+		self.reportButton = QPushButton("Jahresbericht exportieren", self)
+		self.fileGroup.layout().addWidget(self.reportButton, 7, 0)
+		self.reportButton.released.connect(self.exportReport)
+
 	def loadDatabase(self):
 		self.mainWidget.loadDatabase()
 		self.accept()
 
+	def saveDatabaseCopy(self):
+		self.mainWidget.saveDatabaseCopy()
+		self.accept()
+
+	def backupDatabase(self):
+		self.mainWidget.backupDatabase()
+
+	def exportReport(self):
+		self.mainWidget.exportReport()
+
+	def icalExport(self):
+		self.mainWidget.icalExport()
+		self.accept()
+
 	def resetCalendar(self):
 		res = QMessageBox.question(self, "Kalender loeschen?",
 					   "Wollen Sie wirklich alle Kalendereintraege "
@@ -1534,11 +836,26 @@ class Calendar(QCalendarWidget):
 
 		self.setFirstDayOfWeek(Qt.Monday)
 
+		# The view that the cells are painted on.
+		self.view = self.findChild(QTableView)
+		# Render data of the cells, by day number.
+		self.cellData = {}
+		# Cell rectangles of the last paint, by day number.
+		self.cellRects = {}
+		# Day numbers that changed since the last redraw.
+		# None, if all cells changed.
+		self.dirtyDays = set()
+		self.currentPageChanged.connect(self.__pageChanged)
+		# Font resources of the cells, by font and DPI.
+		self.fontResources = {}
+
 		self.today = QDate.currentDate()
 		self.armTodayTimer()
 
 	def todayTimer(self):
+		self.dirtyDays.add(dateToDay(self.today))
 		self.today = self.today.addDays(1)
+		self.dirtyDays.add(dateToDay(self.today))
 		self.setSelectedDate(self.today)
 		self.armTodayTimer()
 		self.redraw()
@@ -1589,19 +906,93 @@ class Calendar(QCalendarWidget):
 		SHIFT_DAY	: "O",
 	}
 
+	def dbChanged(self, table, date):
+		if table is not None and\
+		   table not in TsDatabase.DAYTABLE_COLUMNS:
+			return
+		if date is None:
+			self.cellData = {}
+			self.dirtyDays = None
+			if table is None:
+				self.__prefetch()
+		else:
+			day = dateToDay(date)
+			self.cellData.pop(day, None)
+			if self.dirtyDays is not None:
+				self.dirtyDays.add(day)
+
+	def __pageChanged(self, year, month):
+		# All cells are repainted at new positions.
+		self.cellRects = {}
+		self.__prefetch()
+
+	def __prefetch(self):
+		# Load the day states of all visible cells at once, so that
+		# painting doesn't wait for a running background commit.
+		first = QDate(self.yearShown(), self.monthShown(), 1)
+		self.mainWidget.db.prefetchRange(first.addDays(-7),
+						 first.addDays(6 * 7))
+
+	def __getCellData(self, date, day):
+		try:
+			return self.cellData[day]
+		except KeyError:
+			pass
+		mainWidget = self.mainWidget
+		db = mainWidget.db
+		with db.operation("paintCell"):
+			dayFlags = db.getDayFlags(date)
+			typeText = self.typeLetter[mainWidget.getDayType(date)]
+			if not typeText:
+				if dayFlags & DFLAG_ATTENDANT:
+					typeText = "A"
+			shiftOverride = db.getShiftOverride(date)
+			data = self.cellData[day] = (
+				mainWidget.dateHasSnapshot(date),
+				mainWidget.dateHasComment(date),
+				mainWidget.dateHasTimeOverrides(date),
+				typeText,
+				None if shiftOverride is None else\
+				self.shiftLetter[shiftOverride],
+				bool(dayFlags & DFLAG_UNCERTAIN),
+			)
+		return data
+
+	def __getFontResources(self, font):
+		# Returns the bold cell font, the widths of all cell texts
+		# and the text height. Prepared once per font and DPI.
+		key = (font.key(), self.logicalDpiY())
+		try:
+			return self.fontResources[key]
+		except KeyError:
+			pass
+		font = QFont(font)
+		font.setBold(True)
+		metrics = QFontMetrics(font)
+		texts = set(t for t in self.typeLetter.values() if t)
+		texts.update(self.shiftLetter.values())
+		texts.update(("A", "???"))
+		res = self.fontResources[key] = (
+			font,
+			{ t : metrics.width(t) for t in texts },
+			metrics.height(),
+		)
+		return res
+
 	def paintCell(self, painter, rect, date):
 		QCalendarWidget.paintCell(self, painter, rect, date)
 		painter.save()
 
-		mainWidget, font = self.mainWidget, painter.font()
-		db = mainWidget.db
-		rx, ry, rw, rh = rect.x(), rect.y(), rect.width(), rect.height()
-		dayFlags = db.getDayFlags(date)
+		day = dateToDay(date)
+		self.cellRects[day] = QRect(rect)
+		(hasSnapshot, hasComment, hasTimeOverrides,
+		 typeText, shiftText, uncertain) = self.__getCellData(date, day)
 
-		font.setBold(True)
+		font, textWidths, textHeight = self.__getFontResources(painter.font())
 		painter.setFont(font)
+		rx, ry, rw, rh = rect.x(), rect.y(), rect.width(), rect.height()
 
-		if mainWidget.dateHasSnapshot(date):
+		if hasSnapshot:
 			painter.setPen(self.snapshotPen)
 		else:
 			painter.setPen(self.framePen)
@@ -1614,59 +1005,44 @@ class Calendar(QCalendarWidget):
 				       (rw - 3, rh - 3)):
 				painter.drawPoint(rx + x, ry + y)
 
-		if mainWidget.dateHasComment(date):
+		if hasComment:
 			painter.setPen(self.commentPen)
 			painter.drawRect(rx + 3, ry + 3, rw - 3 - 3, rh - 3 - 3)
 
-		if mainWidget.dateHasTimeOverrides(date):
+		if hasTimeOverrides:
 			painter.setPen(self.overridesPen)
 			painter.drawPoint(rx + rw - 8, ry + 8)
 
-		text = self.typeLetter[mainWidget.getDayType(date)]
-		if not text:
-			if dayFlags & DFLAG_ATTENDANT:
-				text = "A"
-		if text:
+		if typeText:
 			painter.setPen(self.lowerLeftPen)
-			painter.drawText(rx + 4, ry + rh - 4, text)
+			painter.drawText(rx + 4, ry + rh - 4, typeText)
 
-		shiftOverride = db.getShiftOverride(date)
-		if shiftOverride is not None:
-			text = self.shiftLetter[shiftOverride]
+		if shiftText:
 			painter.setPen(self.lowerRightPen)
-			metrics = QFontMetrics(painter.font())
-			painter.drawText(rx + rw - metrics.width(text) - 4,
+			painter.drawText(rx + rw - textWidths[shiftText] - 4,
 					 ry + rh - 4,
-					 text)
+					 shiftText)
 
-		if dayFlags & DFLAG_UNCERTAIN:
+		if uncertain:
 			text = "???"
 			painter.setPen(self.centerPen)
-			metrics = QFontMetrics(painter.font())
-			painter.drawText(rx + rw // 2 - metrics.width(text) // 2,
-					 ry + rh // 2 + metrics.height() // 2,
+			painter.drawText(rx + rw // 2 - textWidths[text] // 2,
+					 ry + rh // 2 + textHeight // 2,
 					 text)
 
 		painter.restore()
 
 	def redraw(self):
-		if self.isVisible():
-			self.hide()
-			self.show()
-
-class AccountState(QObject):
-	"Calculated account state."
-
-	def __init__(self, date, shiftConfigIndex=0,
-		     accountAtStartOfDay=0.0, accountAtEndOfDay=0.0,
-		     holidaysAtStartOfDay=0, holidaysAtEndOfDay=0):
-		QObject.__init__(self)
-		self.date = date
-		self.shiftConfigIndex = shiftConfigIndex
-		self.accountAtStartOfDay = accountAtStartOfDay
-		self.accountAtEndOfDay = accountAtEndOfDay
-		self.holidaysAtStartOfDay = holidaysAtStartOfDay
-		self.holidaysAtEndOfDay = holidaysAtEndOfDay
+		"""Repaint the cells that changed since the last redraw."""
+		dirtyDays, self.dirtyDays = self.dirtyDays, set()
+		if dirtyDays is None or self.view is None:
+			self.updateCells()
+			return
+		viewport, cellRects = self.view.viewport(), self.cellRects
+		for day in dirtyDays:
+			rect = cellRects.get(day)
+			if rect is not None:
+				viewport.update(rect)
 
 class MainWidget(QWidget):
 	def __init__(self, parent=None):
@@ -1729,20 +1105,45 @@ class MainWidget(QWidget):
 		self.output.setFrameShadow(QFrame.Raised)
 		self.layout().addWidget(self.output, 5, 0, 1, 2)
 
-		self.db = TsDatabase()
-		self.resetState()
+		self.db = GuiDatabase()
+		self.db.addChangeCallback(self.calendar.dbChanged)
+		self.account = AccountEngine(self.db)
+		self.worker = BackgroundWorker(self.db, self.account)
+		self.worker.accountStateReady.connect(self.__accountStateReady)
+		self.db.worker = self.worker
+		if os.environ.get("TIMESHIFT_SQLSTATS"):
+			self.db.enableStats()
+		self.sqlStatsShortcut = QShortcut(QKeySequence("Ctrl+Shift+S"), self)
+		self.sqlStatsShortcut.activated.connect(self.__sqlStatsShortcut)
+		# The new in-memory database is empty. No need to reset it.
+		self.worldUpdate()
 
 	def shutdown(self):
+		self.db.worker = None
+		self.worker.stop()
+		if self.db.stats:
+			self.db.stats.dump()
 		self.db.close()
 
+	def __sqlStatsShortcut(self):
+		# Enable the SQL statistics or dump and reset them.
+		stats = self.db.stats
+		if stats:
+			stats.dump()
+			stats.reset()
+		else:
+			self.db.enableStats()
+			printInfo("SQL statistics enabled.")
+
 	def resetState(self):
 		self.db.resetDatabase()
 		self.worldUpdate()
 
 	def worldUpdate(self):
-		self.updateTitle()
-		self.recalculate()
-		self.calendar.redraw()
+		with self.db.operation("worldUpdate"):
+			self.updateTitle()
+			self.recalculate()
+			self.calendar.redraw()
 
 	def __worldUpdateTimerTimeout(self):
 		self.worldUpdate()
@@ -1776,6 +1177,89 @@ class MainWidget(QWidget):
 		if fn:
 			self.doLoadDatabase(fn)
 
+	def __cloneDatabase(self, target=None):
+		# Copy the database to 'target' or to the backup file.
+		# Returns the target file name or None on failure.
+		progress = QProgressDialog("Datenbank wird kopiert...",
+					   None, 0, 0, self)
+		progress.setWindowModality(Qt.WindowModal)
+		progress.setMinimumDuration(500)
+		def updateProgress(copiedPages, totalPages):
+			progress.setMaximum(totalPages)
+			progress.setValue(copiedPages)
+		try:
+			if target is None:
+				target = self.db.backup(updateProgress)
+			else:
+				self.db.clone(target, updateProgress)
+		except TsException as e:
+			QMessageBox.critical(self, "Kopieren fehlgeschlagen",
+					     "Kopieren fehlgeschlagen:\n" + str(e))
+			return None
+		finally:
+			progress.close()
+		return target
+
+	def saveDatabaseCopy(self):
+		fn, fil = QFileDialog.getSaveFileName(self,
+			"Kopie speichern unter", "",
+			"Timeshift Dateien (*.tmd);;"
+			"Alle Dateien (*)")
+		if not fn:
+			return
+		if not self.db.isInMemory() and\
+		   QFileInfo(fn) == QFileInfo(self.db.getFilename()):
+			QMessageBox.critical(self, "Kopieren fehlgeschlagen",
+					     "Die Datenbank kann nicht auf "
+					     "sich selbst kopiert werden.")
+			return
+		self.__cloneDatabase(fn)
+
+	def backupDatabase(self):
+		target = self.__cloneDatabase()
+		if target:
+			QMessageBox.information(self, "Sicherung erstellt",
+						"Sicherung gespeichert:\n" + target)
+
+	def exportReport(self):
+		year, ok = QInputDialog.getInt(self, "Jahresbericht", "Jahr:",
+			self.calendar.selectedDate().year(), 1, 9999)
+		if not ok:
+			return
+		fn, fil = QFileDialog.getSaveFileName(self,
+			"Jahresbericht speichern unter", "",
+			"CSV Dateien (*.csv);;"
+			"JSON Dateien (*.json);;"
+			"Alle Dateien (*)")
+		if not fn:
+			return
+		try:
+			writeReport(self.account, QDate(year, 1, 1), QDate(year, 12, 31),
+				    fn, "json" if "json" in fil.lower() else None)
+		except TsException as e:
+			QMessageBox.critical(self, "Bericht fehlgeschlagen",
+					     "Bericht fehlgeschlagen:\n" + str(e))
+
+	def icalExport(self):
+		year, ok = QInputDialog.getInt(self, "iCalendar export", "Jahr:",
+			self.calendar.selectedDate().year(), 1, 9999)
+		if not ok:
+			return
+		fn, fil = QFileDialog.getSaveFileName(self,
+			"iCalendar speichern unter", "",
+			"iCalendar Dateien (*.ics);;"
+			"Alle Dateien (*)")
+		if not fn:
+			return
+		import tsical
+		try:
+			with open(fn, "w", encoding="UTF-8", newline="") as fd:
+				tsical.ICalExport(self.db).exportICal(fd,
+					QDate(year, 1, 1), QDate(year, 12, 31))
+		except (IOError, TsException) as e:
+			QMessageBox.critical(self, "Export fehlgeschlagen",
+					     "Export fehlgeschlagen:\n" + str(e))
+
 	def updateTitle(self):
 		if self.db.isInMemory():
 			suffix = "<in memory>"
@@ -1829,7 +1313,7 @@ class MainWidget(QWidget):
 			# last shapshot.
 			snapshot = self.db.findSnapshotForDate(date)
 			if snapshot:
-				accState = self.__calcAccountState(
+				accState = self.account.calcAccountState(
 					snapshot, date)
 		else:
 			# We already have a snapshot on that day. Modify it.
@@ -1854,55 +1338,43 @@ class MainWidget(QWidget):
 		shiftConfigItem = self.getShiftConfigItemForDate(date)
 		assert(shiftConfigItem)
 
-		# Day type
-		index = self.typeCombo.currentIndex()
-		self.setDayType(date, self.typeCombo.itemData(index))
-
-		# Shift override
-		index = self.shiftCombo.currentIndex()
-		shift = self.shiftCombo.itemData(index)
-		if shift == shiftConfigItem.shift:
-			shift = None
-		self.setShiftOverride(date, shift)
-
-		# Work time override
-		workTime = self.workTime.value()
-		if floatEqual(workTime, shiftConfigItem.workTime):
-			workTime = None
-		self.setWorkTimeOverride(date, workTime)
-
-		# Break time override
-		breakTime = self.breakTime.value()
-		if floatEqual(breakTime, shiftConfigItem.breakTime):
-			breakTime = None
-		self.setBreakTimeOverride(date, breakTime)
-
-		# Attendance time override
-		attendanceTime = self.attendanceTime.value()
-		if floatEqual(attendanceTime, shiftConfigItem.attendanceTime):
-			attendanceTime = None
-		self.setAttendanceTimeOverride(date, attendanceTime)
+		with self.db.operation("overrideChanged"), self.db.batch():
+			# Day type
+			index = self.typeCombo.currentIndex()
+			self.setDayType(date, self.typeCombo.itemData(index))
+
+			# Shift override
+			index = self.shiftCombo.currentIndex()
+			shift = self.shiftCombo.itemData(index)
+			if shift == shiftConfigItem.shift:
+				shift = None
+			self.setShiftOverride(date, shift)
+
+			# Work time override
+			workTime = self.workTime.value()
+			if floatEqual(workTime, shiftConfigItem.workTime):
+				workTime = None
+			self.setWorkTimeOverride(date, workTime)
+
+			# Break time override
+			breakTime = self.breakTime.value()
+			if floatEqual(breakTime, shiftConfigItem.breakTime):
+				breakTime = None
+			self.setBreakTimeOverride(date, breakTime)
+
+			# Attendance time override
+			attendanceTime = self.attendanceTime.value()
+			if floatEqual(attendanceTime, shiftConfigItem.attendanceTime):
+				attendanceTime = None
+			self.setAttendanceTimeOverride(date, attendanceTime)
 
 		self.scheduleWorldUpdate()
 
 	def getShiftConfigIndexForDate(self, date):
-		# Find the shift config index that's valid for the date.
-		# May return -1 on error.
-		snapshot = self.db.findSnapshotForDate(date)
-		if not snapshot:
-			return -1
-		daysBetween = snapshot.date.daysTo(date)
-		assert(daysBetween >= 0)
-		index = snapshot.shiftConfigIndex
-		index += daysBetween
-		index %= len(self.db.getShiftConfigItems())
-		return index
+		return self.account.getShiftConfigIndexForDate(date)
 
 	def getShiftConfigItemForDate(self, date):
-		index = self.getShiftConfigIndexForDate(date)
-		if index >= 0:
-			return self.db.getShiftConfigItems()[index]
-		return None
+		return self.account.getShiftConfigItemForDate(date)
 
 	def enableOverrideControls(self, enable):
 		self.typeCombo.setEnabled(enable)
@@ -1962,48 +1434,6 @@ class MainWidget(QWidget):
 		       self.db.hasWorkTimeOverride(date) or\
 		       self.db.hasBreakTimeOverride(date)
 
-	def __calcAccountState(self, snapshot, endDate):
-		shiftConfig = self.db.getShiftConfigItems()
-		nrShiftConfigs = len(shiftConfig)
-		state = AccountState(
-			date = snapshot.date,
-			shiftConfigIndex = snapshot.shiftConfigIndex,
-			accountAtStartOfDay = snapshot.accountValue,
-			accountAtEndOfDay = snapshot.accountValue,
-			holidaysAtStartOfDay = snapshot.holidaysLeft,
-			holidaysAtEndOfDay = snapshot.holidaysLeft
-		)
-		assert(state.date <= endDate)
-		while True:
-			shiftConfigItem = shiftConfig[state.shiftConfigIndex]
-			currentShift = self.getRealShift(state.date, shiftConfigItem)
-			workTime = self.getRealWorkTime(state.date, shiftConfigItem)
-			breakTime = self.getRealBreakTime(state.date, shiftConfigItem)
-			attendanceTime = self.getRealAttendanceTime(state.date, shiftConfigItem)
-
-			dtype = self.getDayType(state.date)
-			if dtype == DTYPE_DEFAULT:
-				if attendanceTime > 0.001:
-					state.accountAtEndOfDay += attendanceTime
-					state.accountAtEndOfDay -= workTime
-					state.accountAtEndOfDay -= breakTime
-			elif dtype == DTYPE_COMPTIME:
-				state.accountAtEndOfDay -= workTime
-			elif dtype == DTYPE_HOLIDAY:
-				state.holidaysAtEndOfDay -= 1
-			elif dtype in (DTYPE_FEASTDAY, DTYPE_SHORTTIME):
-				pass # no change
-			else:
-				assert(0)
-
-			if state.date == endDate:
-				break
-			state.date = state.date.addDays(1)
-			state.shiftConfigIndex = (state.shiftConfigIndex + 1) % nrShiftConfigs
-			state.accountAtStartOfDay = state.accountAtEndOfDay
-			state.holidaysAtStartOfDay = state.holidaysAtEndOfDay
-		return state
-
 	def recalculate(self):
 		selDate = self.calendar.selectedDate()
 		shiftConfig = self.db.getShiftConfigItems()
@@ -2024,10 +1454,7 @@ class MainWidget(QWidget):
 
 		self.enableOverrideControls(True)
 
-		# Then calculate the account state
-		accState = self.__calcAccountState(snapshot, selDate)
-
-		shiftConfigItem = shiftConfig[accState.shiftConfigIndex]
+		shiftConfigItem = self.getShiftConfigItemForDate(selDate)
 		dtype = self.getDayType(selDate)
 		shift = self.getRealShift(selDate, shiftConfigItem)
 		workTime = self.getRealWorkTime(selDate, shiftConfigItem)
@@ -2042,7 +1469,13 @@ class MainWidget(QWidget):
 		self.attendanceTime.setValue(attendanceTime)
 		self.overrideChangeBlocked = False
 
-		dateString = selDate.toString("dd.MM.yyyy")
+		# Then calculate the account state in the background.
+		self.worker.requestAccountState(selDate)
+
+	def __accountStateReady(self, date, accState):
+		if accState is None or date != self.calendar.selectedDate():
+			return # Outdated. A newer request is pending.
+		dateString = date.toString("dd.MM.yyyy")
 		self.output.setText("Stand %s:  %.1f h -> %.1f h  U: %d d" %\
 			(dateString, round(accState.accountAtStartOfDay, 1),
 			 round(accState.accountAtEndOfDay, 1),
@@ -2052,10 +1485,23 @@ class MainWindow(QMainWindow):
 	def __init__(self, parent=None):
 		QMainWindow.__init__(self, parent)
 		self.titleSuffix = None
+		self.firstPaintCallback = None
 		self.__updateTitle()
 
 		self.setCentralWidget(MainWidget(self))
 
+	def setFirstPaintCallback(self, callback):
+		"""Call 'callback' from the event loop,
+		after the window was painted for the first time."""
+		self.firstPaintCallback = callback
+
+	def paintEvent(self, e):
+		QMainWindow.paintEvent(self, e)
+		callback, self.firstPaintCallback = self.firstPaintCallback, None
+		if callback:
+			# Run after the painted frame was flushed.
+			QTimer.singleShot(0, callback)
+
 	def loadDatabase(self, filename, quiet=False):
 		return self.centralWidget().doLoadDatabase(filename, quiet)
 
@@ -2078,21 +1524,81 @@ def listdir(p):
 	except Exception as e:
 		return []
 
+class StartupTimer(object):
+	"""Prints the duration of the startup steps, if enabled."""
+
+	def __init__(self, enabled):
+		self.enabled = enabled
+		self.lastTime = startupBeginTime
+
+	def step(self, name):
+		if not self.enabled:
+			return
+		now = time.perf_counter()
+		printInfo("Startup: %-14s %8.1f ms  (total %8.1f ms)" % (
+			  name, (now - self.lastTime) * 1000.0,
+			  (now - startupBeginTime) * 1000.0))
+		self.lastTime = now
+
+def usage():
+	print("Usage: timeshift.py [OPTIONS] [DATABASE]")
+	print("")
+	print("Options:")
+	print(" -t|--startup-time          Print the duration of the startup steps")
+	print(" -h|--help                  Show this help text")
+
 def main(argv):
+	import getopt
+
+	opt_startupTime = bool(os.environ.get("TIMESHIFT_STARTUPTIME"))
+	try:
+		(opts, args) = getopt.getopt(argv[1:],
+			"ht",
+			[ "help", "startup-time", ])
+		for (o, v) in opts:
+			if o in ("-h", "--help"):
+				usage()
+				return 0
+			if o in ("-t", "--startup-time"):
+				opt_startupTime = True
+	except getopt.GetoptError as e:
+		usage()
+		return 1
+	startup = StartupTimer(opt_startupTime)
+	startup.step("imports")
+
 	print("Using PySide: %s" % usingPySide)
-	app = QApplication(argv)
+	app = QApplication(argv[:1])
 	mainwnd = MainWindow()
-	if len(argv) == 2 and argv[1].strip():
-		if not mainwnd.loadDatabase(argv[1]):
-			return 1
-	else:
-		if not (listdir("/mnt/sdcard") and
-			mainwnd.loadDatabase("/mnt/sdcard/timeshift.tmd",
-					     quiet=True)):
-			dbPath = str(pathlib.Path.home() / ".timeshift.tmd")
-			if not mainwnd.loadDatabase(dbPath, quiet=True):
-				print("Failed to load default database.", file=sys.stderr)
+	startup.step("main window")
 	mainwnd.show()
+
+	def accountStateReady(date, state):
+		mainwnd.centralWidget().worker.accountStateReady.disconnect(
+			accountStateReady)
+		startup.step("account state")
+
+	def loadDatabase():
+		# Runs after the first frame was drawn.
+		startup.step("first frame")
+		mainwnd.centralWidget().worker.accountStateReady.connect(
+			accountStateReady)
+		if len(args) == 1 and args[0].strip():
+			if not mainwnd.loadDatabase(args[0]):
+				app.exit(1)
+				return
+		else:
+			if not (listdir("/mnt/sdcard") and
+				mainwnd.loadDatabase("/mnt/sdcard/timeshift.tmd",
+						     quiet=True)):
+				import pathlib
+				dbPath = str(pathlib.Path.home() / ".timeshift.tmd")
+				if not mainwnd.loadDatabase(dbPath, quiet=True):
+					print("Failed to load default database.", file=sys.stderr)
+		startup.step("database")
+
+	# A zero timer would usually run before the window is exposed.
+	mainwnd.setFirstPaintCallback(loadDatabase)
 	return app.exec_()
 
 if __name__ == "__main__":
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+# timeshift - Simple work time scheduler
+# Benchmarks with synthetic databases
+# Copyright (c) 2009-2020 Michael Buesch <m@bues.ch>
+# Licensed under the GNU/GPL version 2 or later.
+"""
+
+import sys
+import os
+import io
+import json
+import time
+import random
+import shutil
+import tempfile
+import datetime
+
+# Run without a display by default.
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from timeshift import *
+from tsical import *
+
+BENCH_BEGIN = datetime.date(2000, 1, 1)
+
+def generateDatabase(filename, years, snapshotDays, nrShiftConfigs, seed=0):
+	"""Create a synthetic database file with 'years' years of day data
+	and a snapshot every 'snapshotDays' days (0: only the first day)."""
+	rand = random.Random(seed)
+	nrDays = years * 365
+	dates = [ BENCH_BEGIN + datetime.timedelta(days=i)
+		  for i in range(nrDays) ]
+	db = TsDatabase()
+	with db.batch():
+		db.setShiftConfigItems([
+			ShiftConfigItem("Schicht %d" % i, i % 4,
+					7.0 + (i % 3) * 0.5, 0.5,
+					8.0 + (i % 3) * 0.5)
+			for i in range(nrShiftConfigs) ])
+		db.setShiftOverrides((d, rand.randrange(4)) for d in dates
+				     if rand.random() < 0.3)
+		db.setDayTypeOverrides((d, rand.choice((DTYPE_COMPTIME,
+							DTYPE_HOLIDAY,
+							DTYPE_FEASTDAY)))
+				       for d in dates if rand.random() < 0.1)
+		db.setComments((d, "Kommentar %d" % i)
+			       for (i, d) in enumerate(dates)
+			       if rand.random() < 0.05)
+		for date in dates:
+			r = rand.random()
+			if r < 0.2:
+				db.setWorkTimeOverride(date, 6.0 + r * 10.0)
+			if r < 0.1:
+				db.setBreakTimeOverride(date, 0.75)
+			if r < 0.05:
+				db.setAttendanceTimeOverride(date, 9.0)
+				db.setDayFlags(date, DFLAG_ATTENDANT)
+			elif r > 0.98:
+				db.setDayFlags(date, DFLAG_UNCERTAIN)
+		for (i, date) in enumerate(dates):
+			if i == 0 or (snapshotDays and i % snapshotDays == 0):
+				db.setSnapshot(date, Snapshot(date,
+					rand.randrange(nrShiftConfigs),
+					rand.uniform(-20.0, 20.0), 30))
+	db.clone(filename)
+	db.close()
+	return dates[-1]
+
+class Benchmark(object):
+	def __init__(self, repeat, tmpdir, outFd, fmt):
+		self.repeat = repeat
+		self.tmpdir = tmpdir
+		self.outFd = outFd
+		self.fmt = fmt
+		self.scenario = {}
+
+	def emit(self, name, times):
+		times = sorted(times)
+		result = dict(self.scenario)
+		result.update({
+			"test"		: name,
+			"runs"		: len(times),
+			"min_ms"	: round(times[0] * 1000.0, 3),
+			"median_ms"	: round(times[len(times) // 2] * 1000.0, 3),
+			"max_ms"	: round(times[-1] * 1000.0, 3),
+		})
+		if self.fmt == "json":
+			self.outFd.write(json.dumps(result, sort_keys=True) + "\n")
+		else:
+			self.outFd.write("%3d years  snap %4d  %-16s %10.3f ms "
+					 "(min %.3f, max %.3f)\n" % (
+					 result["years"], result["snapshotDays"],
+					 name, result["median_ms"],
+					 result["min_ms"], result["max_ms"]))
+		self.outFd.flush()
+
+	def measure(self, name, func, setup=None, teardown=None):
+		"""Run func(arg) self.repeat times, with arg=setup()."""
+		times = []
+		for i in range(self.repeat):
+			arg = setup() if setup else None
+			t = time.perf_counter()
+			func(arg)
+			times.append(time.perf_counter() - t)
+			if teardown:
+				teardown(arg)
+		self.emit(name, times)
+
+	def tmpFile(self, name):
+		return os.path.join(self.tmpdir, name)
+
+	def run(self, app, years, snapshotDays, nrShiftConfigs):
+		self.scenario = {
+			"years"		: years,
+			"snapshotDays"	: snapshotDays,
+			"shiftConfigs"	: nrShiftConfigs,
+		}
+		filename = self.tmpFile("bench-%d-%d.tmd" % (years, snapshotDays))
+		if os.path.exists(filename):
+			os.unlink(filename)
+		t = time.perf_counter()
+		lastDate = generateDatabase(filename, years, snapshotDays,
+					    nrShiftConfigs)
+		self.emit("generate", [ time.perf_counter() - t ])
+		self.__runCore(filename, lastDate)
+		self.__runGui(app, filename, lastDate)
+		os.unlink(filename)
+
+	def __runCore(self, filename, lastDate):
+		db = TsDatabase()
+
+		self.measure("open",
+			lambda _: db.open(filename),
+			teardown=lambda _: db.close())
+
+		# Close after removing half of the data,
+		# so that free pages are reclaimed.
+		def closeSetup():
+			copy = self.tmpFile("close.tmd")
+			shutil.copyfile(filename, copy)
+			db.open(copy)
+			dates = [ lastDate - datetime.timedelta(days=i)
+				  for i in range(0, (lastDate - BENCH_BEGIN).days, 2) ]
+			with db.batch():
+				db.setShiftOverrides((d, None) for d in dates)
+				db.setComments((d, "") for d in dates)
+			return copy
+		self.measure("close",
+			lambda _: db.close(),
+			setup=closeSetup,
+			teardown=os.unlink)
+
+		db.open(filename)
+		target = self.tmpFile("clone.tmd")
+		self.measure("clone",
+			lambda _: db.clone(target),
+			teardown=lambda _: os.unlink(target))
+
+		def accountSetup():
+			engine = AccountEngine(db)
+			engine.resetCheckpoints()
+			return engine
+		self.measure("account_far",
+			lambda engine: engine.calcAccountStateForDate(lastDate),
+			setup=accountSetup)
+		engine = AccountEngine(db)
+		engine.calcAccountStateForDate(lastDate)
+		self.measure("account_near",
+			lambda _: engine.calcAccountStateForDate(
+				lastDate - datetime.timedelta(days=3)))
+
+		yearBegin = datetime.date(lastDate.year, 1, 1)
+		self.measure("report_year",
+			lambda _: engine.calcReport(yearBegin, lastDate))
+
+		def icalExport(_=None):
+			fd = io.StringIO()
+			ICalExport(db).exportICal(fd, BENCH_BEGIN, lastDate)
+			return fd
+		self.measure("ical_export", icalExport)
+		icalData = icalExport().getvalue().encode("UTF-8")
+		def icalImportSetup():
+			importDb = TsDatabase()
+			importDb.setShiftConfigItems(db.getShiftConfigItems())
+			return importDb
+		self.measure("ical_import",
+			lambda importDb: ICalImport(importDb).importICal(
+				io.BytesIO(icalData),
+				ICalImport_Opts(SHIFT_DEFAULT, DTYPE_DEFAULT)),
+			setup=icalImportSetup,
+			teardown=lambda importDb: importDb.close())
+		db.close()
+
+	def __runGui(self, app, filename, lastDate):
+		mainwnd = MainWindow()
+		mainwnd.resize(480, 800)
+		mainwnd.show()
+		mainWidget = mainwnd.centralWidget()
+		calendar = mainWidget.calendar
+		if not mainwnd.loadDatabase(filename, quiet=True):
+			raise TsException("Failed to load '%s'" % filename)
+		app.processEvents()
+
+		# Paint one month with cold caches.
+		months = iter(range(self.repeat * 1000))
+		def paintSetup():
+			month = next(months)
+			calendar.setCurrentPage(lastDate.year - month // 12 % 2,
+						month % 12 + 1)
+			calendar.dbChanged(None, None)
+			app.processEvents()
+		self.measure("paint_month",
+			lambda _: calendar.grab(),
+			setup=paintSetup)
+
+		# Recalculate a distant date after a reload
+		# without any account checkpoints.
+		def waitAccountState(date, action):
+			done = []
+			def ready(readyDate, state):
+				if readyDate == date:
+					done.append(state)
+			mainWidget.worker.accountStateReady.connect(ready)
+			action()
+			while not done:
+				app.processEvents(QEventLoop.WaitForMoreEvents)
+			mainWidget.worker.accountStateReady.disconnect(ready)
+		beginDate = QDate(BENCH_BEGIN.year, BENCH_BEGIN.month,
+				  BENCH_BEGIN.day)
+		farDate = QDate(lastDate.year, lastDate.month, lastDate.day)
+		def recalculateSetup():
+			calendar.setSelectedDate(beginDate)
+			waitAccountState(beginDate,
+				lambda: mainwnd.loadDatabase(filename, quiet=True))
+			mainWidget.account.resetCheckpoints()
+		self.measure("recalculate_far",
+			lambda _: waitAccountState(farDate,
+				lambda: calendar.setSelectedDate(farDate)),
+			setup=recalculateSetup)
+
+		mainwnd.close()
+
+def usage():
+	print("Usage: tsbench.py [OPTIONS]")
+	print("")
+	print("Benchmark the database and the account calculation")
+	print("with synthetic databases.")
+	print("")
+	print("Options:")
+	print(" -y|--years LIST            Comma separated list of years")
+	print("                            of day data. Default: 1,5,20")
+	print(" -s|--snapshots LIST        Comma separated list of snapshot")
+	print("                            intervals in days (0: only one snapshot).")
+	print("                            Default: 0,30")
+	print(" -c|--shiftconfigs COUNT    Number of shift configurations. Default: 4")
+	print(" -r|--repeat COUNT          Number of runs per test. Default: 5")
+	print(" -f|--format FORMAT         Output format: json (default) or text")
+	print(" -o|--output FILE           Write the results to FILE")
+	print(" -h|--help                  Show this help text")
+
+def main(argv):
+	import getopt
+
+	opt_years = [ 1, 5, 20 ]
+	opt_snapshots = [ 0, 30 ]
+	opt_shiftConfigs = 4
+	opt_repeat = 5
+	opt_format = "json"
+	opt_output = None
+	try:
+		(opts, args) = getopt.getopt(argv[1:],
+			"hy:s:c:r:f:o:",
+			[ "help", "years=", "snapshots=", "shiftconfigs=",
+			  "repeat=", "format=", "output=", ])
+		for (o, v) in opts:
+			if o in ("-h", "--help"):
+				usage()
+				return 0
+			if o in ("-y", "--years"):
+				opt_years = [ int(y) for y in v.split(",") ]
+			if o in ("-s", "--snapshots"):
+				opt_snapshots = [ int(s) for s in v.split(",") ]
+			if o in ("-c", "--shiftconfigs"):
+				opt_shiftConfigs = int(v)
+			if o in ("-r", "--repeat"):
+				opt_repeat = int(v)
+			if o in ("-f", "--format"):
+				opt_format = v
+			if o in ("-o", "--output"):
+				opt_output = v
+	except (getopt.GetoptError, ValueError) as e:
+		usage()
+		return 1
+	if opt_format not in ("json", "text") or\
+	   min(opt_years) < 1 or min(opt_snapshots) < 0 or\
+	   opt_shiftConfigs < 1 or opt_repeat < 1:
+		usage()
+		return 1
+
+	app = QApplication(argv[:1])
+	if opt_output:
+		outFd = open(opt_output, "w")
+	else:
+		# Keep the results apart from the messages on stdout.
+		outFd, sys.stdout = sys.stdout, sys.stderr
+	try:
+		with tempfile.TemporaryDirectory(prefix="tsbench-") as tmpdir:
+			bench = Benchmark(opt_repeat, tmpdir, outFd, opt_format)
+			for years in opt_years:
+				for snapshotDays in opt_snapshots:
+					bench.run(app, years, snapshotDays,
+						  opt_shiftConfigs)
+	except TsException as e:
+		print(str(e), file=sys.stderr)
+		return 1
+	finally:
+		if opt_output:
+			outFd.close()
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv))
@@ -0,0 +1,2307 @@
+#!/usr/bin/env python3
+"""
+# timeshift - Simple work time scheduler
+# Headless core: database and account calculation
+# Copyright (c) 2009-2020 Michael Buesch <m@bues.ch>
+# Licensed under the GNU/GPL version 2 or later.
+"""
+
+import sys
+import struct
+import sqlite3 as sql
+import array
+import bisect
+import contextlib
+import datetime
+import itertools
+import functools
+import threading
+import time
+
+# Shift types
+SHIFT_DEFAULT		= -1 # (not DB ABI)
+SHIFT_EARLY		= 0
+SHIFT_LATE		= 1
+SHIFT_NIGHT		= 2
+SHIFT_DAY		= 3
+
+# Day type overrides
+DTYPE_DEFAULT		= 0 # (not DB ABI)
+DTYPE_COMPTIME		= 1
+DTYPE_HOLIDAY		= 2
+DTYPE_FEASTDAY		= 3
+DTYPE_SHORTTIME		= 4
+
+# Day flags
+DFLAG_UNCERTAIN		= (1 << 0)
+DFLAG_ATTENDANT		= (1 << 1)
+
+
+def toBase64(string):
+	import base64
+	return base64.standard_b64encode(
+		string.encode("UTF-8", "ignore")).decode("UTF-8", "ignore")
+
+def fromBase64(b64str):
+	import base64
+	return base64.standard_b64decode(
+		b64str.encode("UTF-8", "ignore")).decode("UTF-8", "ignore")
+
+# Binary encoded objects start with BIN_MAGIC followed by the format version.
+# A zero byte never starts the legacy ';' separated text encoding.
+BIN_MAGIC = 0
+
+def packBinary(fmt, values, name):
+	"""Pack 'values' with the struct 'fmt' (starting with magic and version)
+	and append the length prefixed UTF-8 encoded name."""
+	name = name.encode("UTF-8", "ignore")
+	return fmt.pack(*values, len(name)) + name
+
+def unpackBinary(fmt, b):
+	"""Unpack a packBinary() encoding.
+	Returns the tuple of values (without magic and version) and the name."""
+	values = fmt.unpack_from(b)
+	nameLen = values[-1]
+	name = b[fmt.size : fmt.size + nameLen]
+	if len(name) != nameLen:
+		raise ValueError("Truncated name")
+	return values[2:-1], name.decode("UTF-8")
+
+def isBinary(b):
+	return len(b) >= 2 and b[0] == BIN_MAGIC
+
+LIST_ITEM_LEN = struct.Struct("<I")
+
+def packList(items, toBytes):
+	"""Encode a list of objects as length prefixed toBytes() encodings."""
+	return b"".join(LIST_ITEM_LEN.pack(len(b)) + b
+			for b in map(toBytes, items))
+
+def unpackList(b, fromBytes):
+	"""Decode a packList() encoding."""
+	items, offset = [], 0
+	while offset < len(b):
+		(itemLen,) = LIST_ITEM_LEN.unpack_from(b, offset)
+		offset += LIST_ITEM_LEN.size
+		if offset + itemLen > len(b):
+			raise ValueError("Truncated list item")
+		items.append(fromBytes(b[offset : offset + itemLen]))
+		offset += itemLen
+	return items
+
+def floatEqual(f0, f1):
+	return abs(f0 - f1) < 0.001
+
+def printInfo(msg):
+	print(msg, file=sys.stderr)
+
+# Dates are identified by their proleptic (Julian) day number.
+# The core accepts datetime.date objects and any registered date type
+# (for example QDate) and returns dates of the registered type.
+JULIAN_DAY_OFFSET = 1721425 # Julian day number of datetime.date.min - 1
+
+def dateToDay(date):
+	"""Convert a date object to its day number."""
+	if isinstance(date, datetime.date):
+		return date.toordinal() + JULIAN_DAY_OFFSET
+	return date.toJulianDay()
+
+def pyDayToDate(day):
+	"""Convert a day number to a datetime.date object."""
+	return datetime.date.fromordinal(day - JULIAN_DAY_OFFSET)
+
+dayToDate = pyDayToDate
+
+def registerDateType(dateType, fromDay):
+	"""Use 'dateType' as the date type returned by the core.
+	fromDay(dayNumber) must return a 'dateType' object.
+	The type must provide a toJulianDay() method."""
+	global dayToDate
+	sql.register_adapter(dateType, dateToDay)
+	dayToDate = fromDay
+
+def dateToId(date):
+	"""Convert a date object to a unique integer ID.
+	The ID is the day number."""
+	return dateToDay(date)
+
+def idToDate(idNum):
+	"""Convert a unique integer ID to a date object."""
+	return dayToDate(int(idNum))
+
+def msecsIdToDate(idNum):
+	"""Convert a legacy (database v3 and older) local time
+	milliseconds ID to a date object."""
+	date = datetime.datetime.fromtimestamp(int(idNum) / 1000.0).date()
+	return dayToDate(dateToDay(date))
+
+def parseDate(string):
+	"""Parse an ISO 8601 date string (YYYY-MM-DD)."""
+	try:
+		date = datetime.datetime.strptime(string.strip(), "%Y-%m-%d").date()
+	except ValueError as e:
+		raise TsException("Invalid date '%s'" % string)
+	return dayToDate(dateToDay(date))
+
+def formatDate(date):
+	"""Format a date as ISO 8601 string (YYYY-MM-DD)."""
+	return pyDayToDate(dateToDay(date)).isoformat()
+
+class TsException(Exception): pass
+
+class ShiftConfigItem(object):
+	__slots__ = ( "name", "shift", "workTime", "breakTime",
+		      "attendanceTime", )
+
+	def __init__(self, name, shift, workTime, breakTime, attendanceTime):
+		self.name = name
+		self.shift = shift
+		self.workTime = workTime
+		self.breakTime = breakTime
+		self.attendanceTime = attendanceTime
+
+	# Binary v1: magic, version, shift, workTime, breakTime,
+	# attendanceTime, name length. Followed by the name.
+	BIN_VERSION	= 1
+	BIN_FORMAT	= struct.Struct("<BBhdddH")
+
+	@staticmethod
+	def toBytes(item):
+		return packBinary(ShiftConfigItem.BIN_FORMAT,
+			(	BIN_MAGIC,
+				ShiftConfigItem.BIN_VERSION,
+				item.shift,
+				item.workTime,
+				item.breakTime,
+				item.attendanceTime,
+			),
+			item.name)
+
+	@staticmethod
+	def fromBytes(b):
+		if isBinary(b):
+			try:
+				if b[1] != ShiftConfigItem.BIN_VERSION:
+					raise ValueError("Unknown version %d" % b[1])
+				values, name = unpackBinary(ShiftConfigItem.BIN_FORMAT, b)
+				return ShiftConfigItem(name, *values)
+			except (struct.error, ValueError) as e:
+				raise TsException("ShiftConfigItem.fromBytes() "
+						  "invalid data: " + str(e))
+		string = b.decode("UTF-8", "ignore")
+		elems = string.split(";")
+		try:
+			return ShiftConfigItem(
+				fromBase64(elems[0]),
+				int(elems[1], 10),
+				float(elems[2]),
+				float(elems[3]),
+				float(elems[4])
+			)
+		except (IndexError, ValueError) as e:
+			raise TsException("ShiftConfigItem.fromBytes() "
+					  "invalid string: " + string)
+
+class Preset(object):
+	__slots__ = ( "name", "dayType", "shift", "workTime", "breakTime",
+		      "attendanceTime", )
+
+	def __init__(self, name, dayType, shift, workTime, breakTime, attendanceTime):
+		self.name = name
+		self.dayType = dayType
+		self.shift = shift
+		self.workTime = workTime
+		self.breakTime = breakTime
+		self.attendanceTime = attendanceTime
+
+	# Binary v1: magic, version, dayType, shift, workTime, breakTime,
+	# attendanceTime, name length. Followed by the name.
+	BIN_VERSION	= 1
+	BIN_FORMAT	= struct.Struct("<BBhhdddH")
+
+	@staticmethod
+	def toBytes(preset):
+		return packBinary(Preset.BIN_FORMAT,
+			(	BIN_MAGIC,
+				Preset.BIN_VERSION,
+				preset.dayType,
+				preset.shift,
+				preset.workTime,
+				preset.breakTime,
+				preset.attendanceTime,
+			),
+			preset.name)
+
+	@staticmethod
+	def fromBytes(b):
+		if isBinary(b):
+			try:
+				if b[1] != Preset.BIN_VERSION:
+					raise ValueError("Unknown version %d" % b[1])
+				values, name = unpackBinary(Preset.BIN_FORMAT, b)
+				return Preset(name, *values)
+			except (struct.error, ValueError) as e:
+				raise TsException("Preset.fromBytes() "
+						  "invalid data: " + str(e))
+		string = b.decode("UTF-8", "ignore")
+		elems = string.split(";")
+		try:
+			return Preset(
+				fromBase64(elems[0]),
+				int(elems[1], 10),
+				int(elems[2], 10),
+				float(elems[3]),
+				float(elems[4]),
+				float(elems[5])
+			)
+		except (IndexError, ValueError) as e:
+			raise TsException("Preset.fromBytes() "
+					  "invalid string: " + string)
+
+class Snapshot(object):
+	__slots__ = ( "date", "shiftConfigIndex", "accountValue",
+		      "holidaysLeft", )
+
+	def __init__(self, date, shiftConfigIndex, accountValue,
+		     holidaysLeft):
+		self.date = date
+		self.shiftConfigIndex = shiftConfigIndex
+		self.accountValue = accountValue
+		self.holidaysLeft = holidaysLeft
+
+	# Binary v2: magic, version, date ID, shiftConfigIndex,
+	# accountValue, holidaysLeft
+	# Binary v1 is the same, but with a legacy milliseconds date ID.
+	BIN_VERSION	= 2
+	BIN_FORMAT	= struct.Struct("<BBqidi")
+
+	@staticmethod
+	def toBytes(snapshot):
+		return Snapshot.BIN_FORMAT.pack(
+			BIN_MAGIC,
+			Snapshot.BIN_VERSION,
+			dateToId(snapshot.date),
+			snapshot.shiftConfigIndex,
+			snapshot.accountValue,
+			snapshot.holidaysLeft)
+
+	@staticmethod
+	def fromBytes(b):
+		if isBinary(b):
+			try:
+				if b[1] not in (1, Snapshot.BIN_VERSION):
+					raise ValueError("Unknown version %d" % b[1])
+				magic, version, dateId, shiftConfigIndex,\
+					accountValue, holidaysLeft =\
+						Snapshot.BIN_FORMAT.unpack(b)
+				if version == 1:
+					date = msecsIdToDate(dateId)
+				else:
+					date = idToDate(dateId)
+				return Snapshot(date, shiftConfigIndex,
+						accountValue, holidaysLeft)
+			except (struct.error, ValueError) as e:
+				raise TsException("Snapshot.fromBytes() "
+						  "invalid data: " + str(e))
+		string = b.decode("UTF-8", "ignore")
+		elems = string.split(";")
+		try:
+			return Snapshot(
+				msecsIdToDate(int(elems[0], 10)),
+				int(elems[1], 10),
+				float(elems[2]),
+				int(elems[3], 10)
+			)
+		except (IndexError, ValueError) as e:
+			raise TsException("Snapshot.fromBytes() "
+					  "invalid string: " + string)
+
+class DayTable(object):
+	"""Columnar database contents of a date interval.
+	All columns are parallel arrays indexed by the day offset
+	from beginDate. Override columns are None, if there is no override."""
+
+	__slots__ = ( "beginDate", "beginDay", "nrDays",
+		      "dayType", "shift", "workTime", "breakTime",
+		      "attendanceTime", "dayFlags", "hasComment",
+		      "hasSnapshot", )
+
+	def __init__(self, beginDate, nrDays):
+		self.beginDate = beginDate
+		self.beginDay = dateToDay(beginDate)
+		self.nrDays = nrDays
+		self.dayType = [ None ] * nrDays
+		self.shift = [ None ] * nrDays
+		self.workTime = [ None ] * nrDays
+		self.breakTime = [ None ] * nrDays
+		self.attendanceTime = [ None ] * nrDays
+		self.dayFlags = array.array("L", (0,)) * nrDays
+		self.hasComment = bytearray(nrDays)
+		self.hasSnapshot = bytearray(nrDays)
+
+	def getOffset(self, date):
+		return dateToDay(date) - self.beginDay
+
+	def getDate(self, offset):
+		return dayToDate(self.beginDay + offset)
+
+def synchronized(method):
+	"""Method decorator: Call the method with self.lock held."""
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		with self.lock:
+			stats = self.stats
+			if stats is None:
+				return method(self, *args, **kwargs)
+			with stats.method(self, method.__name__):
+				return method(self, *args, **kwargs)
+	return wrapper
+
+class SqlStats(object):
+	"""SQL statement statistics of a TsDatabase.
+	The statements are attributed to the database method that
+	was called from the outside and to the current operation
+	of the calling thread. See TsDatabase.operation()."""
+
+	# Number of VM instructions per progress handler call.
+	PROGRESS_STEPS = 1000
+
+	DEFAULT_OPERATION = "-"
+	DEFAULT_METHOD = "(other)"
+
+	# Counter indices
+	CALLS		= 0
+	STATEMENTS	= 1
+	STEPS		= 2	# In units of PROGRESS_STEPS
+	CHANGES		= 3
+	SECONDS		= 4
+
+	def __init__(self):
+		self.local = threading.local()
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		with self.lock:
+			# (operation, method) -> counters
+			# The method is None for the operation totals.
+			self.counters = {}
+			self.beginTime = time.monotonic()
+
+	def __getCounters(self, operation, method):
+		key = (operation, method)
+		with self.lock:
+			counters = self.counters.get(key)
+			if counters is None:
+				counters = self.counters[key] = [ 0, 0, 0, 0, 0.0 ]
+		return counters
+
+	def install(self, conn):
+		conn.set_trace_callback(self.__trace)
+		conn.set_progress_handler(self.__progress, self.PROGRESS_STEPS)
+
+	@staticmethod
+	def uninstall(conn):
+		conn.set_trace_callback(None)
+		conn.set_progress_handler(None, 0)
+
+	def __current(self):
+		counters = getattr(self.local, "counters", None)
+		if counters is None:
+			counters = self.__getCounters(
+				getattr(self.local, "operation", self.DEFAULT_OPERATION),
+				self.DEFAULT_METHOD)
+		return counters
+
+	def __trace(self, statement):
+		self.__current()[self.STATEMENTS] += 1
+
+	def __progress(self):
+		self.__current()[self.STEPS] += 1
+		return 0
+
+	@contextlib.contextmanager
+	def method(self, db, name):
+		local = self.local
+		if getattr(local, "counters", None) is not None:
+			# Nested call. Attributed to the outer method.
+			yield
+			return
+		counters = self.__getCounters(
+			getattr(local, "operation", self.DEFAULT_OPERATION), name)
+		conn = db.conn
+		changes = conn.total_changes if conn else 0
+		beginTime = time.perf_counter()
+		local.counters = counters
+		try:
+			yield
+		finally:
+			local.counters = None
+			counters[self.CALLS] += 1
+			counters[self.SECONDS] += time.perf_counter() - beginTime
+			if conn and db.conn is conn:
+				counters[self.CHANGES] += conn.total_changes - changes
+
+	@contextlib.contextmanager
+	def operation(self, name):
+		local = self.local
+		if getattr(local, "operation", self.DEFAULT_OPERATION) != self.DEFAULT_OPERATION:
+			# Nested operation. Attributed to the outer operation.
+			yield
+			return
+		counters = self.__getCounters(name, None)
+		beginTime = time.perf_counter()
+		local.operation = name
+		try:
+			yield
+		finally:
+			local.operation = self.DEFAULT_OPERATION
+			with self.lock:
+				counters[self.CALLS] += 1
+				counters[self.SECONDS] += time.perf_counter() - beginTime
+
+	def summary(self):
+		"""Returns the statistics as a list of text lines."""
+		with self.lock:
+			counters = { k : list(v) for (k, v) in self.counters.items() }
+			duration = time.monotonic() - self.beginTime
+		lines = [ "SQL statistics of the last %.1f s:" % duration,
+			  "%-32s %8s %8s %10s %8s %10s" % (
+			  "operation / method", "calls", "stmts",
+			  "steps", "changes", "ms") ]
+		operations = sorted(set(op for (op, m) in counters))
+		for operation in operations:
+			total = counters.get((operation, None))
+			if total:
+				lines.append("%-32s %8d %8s %10s %8s %10.1f" % (
+					     operation, total[self.CALLS], "", "", "",
+					     total[self.SECONDS] * 1000.0))
+			else:
+				lines.append(operation)
+			methods = sorted(((m, c) for ((op, m), c) in counters.items()
+					  if op == operation and m is not None),
+					 key=lambda mc: -mc[1][self.SECONDS])
+			for (method, c) in methods:
+				lines.append("  %-30s %8d %8d %10d %8d %10.1f" % (
+					     method, c[self.CALLS], c[self.STATEMENTS],
+					     c[self.STEPS] * self.PROGRESS_STEPS,
+					     c[self.CHANGES], c[self.SECONDS] * 1000.0))
+		return lines
+
+	def dump(self):
+		for line in self.summary():
+			printInfo(line)
+
+class TsDatabase(object):
+	INMEM		= ":memory:"
+
+	# Durability profiles: pragmas applied to on-disk databases on open.
+	PROFILE_SAFE	= "safe"	# Rollback journal. Sync on every commit.
+	PROFILE_FAST	= "fast"	# Write-ahead log. Sync on checkpoints.
+	PROFILES	= {
+		PROFILE_SAFE : (
+			("journal_mode",	"DELETE"),
+			("synchronous",		"FULL"),
+			("cache_size",		-2000),		# KiB
+			("mmap_size",		0),
+		),
+		PROFILE_FAST : (
+			("journal_mode",	"WAL"),
+			("synchronous",		"NORMAL"),
+			("cache_size",		-8192),		# KiB
+			("mmap_size",		32 * 1024 * 1024),
+			("temp_store",		"MEMORY"),
+		),
+	}
+	DEFAULT_PROFILE	= PROFILE_FAST
+
+	# Free space reclamation: Free pages are only reclaimed, if more than
+	# RECLAIM_THRESHOLD of all pages are free. At most RECLAIM_MAX_PAGES
+	# are reclaimed per call, in steps of RECLAIM_STEP_PAGES.
+	RECLAIM_THRESHOLD	= 0.2
+	RECLAIM_STEP_PAGES	= 256
+	RECLAIM_MAX_PAGES	= 4096
+
+	# Number of pages copied per step by clone().
+	CLONE_STEP_PAGES	= 1024
+
+	# Parameters for the journal sync.
+	PARAM_DBID		= "dbId"	# Random ID of the database
+	PARAM_SYNCSEQ		= "syncSeq:"	# + peer ID: Last merged peer seq
+	VERSION		= 6
+	COMPAT_VERSIONS	= ( 2, 3, 4, 5, 6, ) # Older versions are migrated on open.
+
+	# The date columns are declared as "QDate" for historical reasons.
+	sql.register_adapter(datetime.date, dateToId)
+	sql.register_converter("QDate", idToDate)
+
+	sql.register_adapter(ShiftConfigItem, ShiftConfigItem.toBytes)
+	sql.register_converter("ShiftConfigItem", ShiftConfigItem.fromBytes)
+
+	sql.register_adapter(Preset, Preset.toBytes)
+	sql.register_converter("Preset", Preset.fromBytes)
+
+	sql.register_adapter(Snapshot, Snapshot.toBytes)
+	sql.register_converter("Snapshot", Snapshot.fromBytes)
+
+	TAB_params	= "params(name TEXT PRIMARY KEY NOT NULL, data TEXT) " \
+			  "WITHOUT ROWID"
+	TAB_dayflags	= "dayFlags(date QDate PRIMARY KEY NOT NULL, value INTEGER) " \
+			  "WITHOUT ROWID"
+	TAB_ovr_daytype	= "override_dayType(date QDate PRIMARY KEY NOT NULL, value INTEGER) " \
+			  "WITHOUT ROWID"
+	TAB_ovr_shift	= "override_shift(date QDate PRIMARY KEY NOT NULL, value INTEGER) " \
+			  "WITHOUT ROWID"
+	TAB_ovr_worktm	= "override_workTime(date QDate PRIMARY KEY NOT NULL, value REAL) " \
+			  "WITHOUT ROWID"
+	TAB_ovr_brtm	= "override_breakTime(date QDate PRIMARY KEY NOT NULL, value REAL) " \
+			  "WITHOUT ROWID"
+	TAB_ovr_atttm	= "override_attendanceTime(date QDate PRIMARY KEY NOT NULL, value REAL) " \
+			  "WITHOUT ROWID"
+	TAB_snaps	= "snapshots(date QDate PRIMARY KEY NOT NULL, snapshot Snapshot)"
+	TAB_comments	= "comments(date QDate PRIMARY KEY NOT NULL, comment TEXT)"
+	TAB_shconf	= "shiftConfig(idx INTEGER PRIMARY KEY, item ShiftConfigItem)"
+	TAB_presets	= "presets(idx INTEGER PRIMARY KEY, preset Preset)"
+	# Account state checkpoints. Stored by the AccountEngine and
+	# invalidated by the setters of the ACCOUNT_TABS.
+	TAB_checkpts	= "checkpoints(date QDate PRIMARY KEY NOT NULL, " \
+			  "snapshotDate QDate, shiftConfigIndex INTEGER, " \
+			  "account REAL, holidays INTEGER) " \
+			  "WITHOUT ROWID"
+	# Change journal. The values are stored as passed to the setters.
+	# 'date' is NULL for whole-table changes.
+	TAB_journal	= "journal(seq INTEGER PRIMARY KEY AUTOINCREMENT, " \
+			  "origin TEXT, time REAL, tableName TEXT, date QDate, " \
+			  "oldValue, newValue)"
+
+	TABS		= ( TAB_params, TAB_dayflags,
+			    TAB_ovr_daytype, TAB_ovr_shift,
+			    TAB_ovr_worktm, TAB_ovr_brtm,
+			    TAB_ovr_atttm, TAB_snaps,
+			    TAB_comments, TAB_shconf,
+			    TAB_presets, TAB_checkpts,
+			    TAB_journal, )
+	INDEXES		= ( "journal_key ON journal(tableName, date)", )
+
+	# Per-date tables in a DayTable:
+	#   (tableName, valueColumn, DayTable column, value decoder)
+	DAYTABLE_TABS	= (
+		("override_dayType",	    "value", "dayType",	       int),
+		("override_shift",	    "value", "shift",	       int),
+		("override_workTime",	    "value", "workTime",       float),
+		("override_breakTime",	    "value", "breakTime",      float),
+		("override_attendanceTime", "value", "attendanceTime", float),
+		("dayFlags",		    "value", "dayFlags",
+		 lambda v: int(v) & 0xFFFFFFFF),
+		("comments",		    "1",     "hasComment",     int),
+		("snapshots",		    "1",     "hasSnapshot",    int),
+	)
+	DAYTABLE_COLUMNS = { t[0] : (t[2], t[3]) for t in DAYTABLE_TABS }
+	# Tables that influence the account state calculation.
+	# Changes remove the account checkpoints after the changed date.
+	ACCOUNT_TABS	= ( "override_dayType", "override_shift",
+			    "override_workTime", "override_breakTime",
+			    "override_attendanceTime", "snapshots",
+			    "shiftConfig", )
+	# Number of days loaded into the day-state cache at once.
+	DAYCACHE_BLOCKDAYS = 64
+	# Operation context, if the statistics are disabled.
+	NO_OPERATION = contextlib.nullcontext()
+
+	def __init__(self):
+		# All connection accesses are serialized by this lock.
+		# The day-state cache is only used by the owner thread.
+		# The shift configuration and the snapshots are cached
+		# for all threads and are read without the lock.
+		self.lock = threading.RLock()
+		self.stats = None
+		self.changeCallbacks = []
+		self.batchLevel = 0
+		self.batchChanges = {}
+		self.batchCommitPending = False
+		self.__reset()
+		self.open(self.INMEM)
+
+	def __del__(self):
+		self.conn.close()
+
+	def __sqlError(self, exception):
+		msg = "SQL error: " + str(exception)
+		printInfo(msg)
+		import traceback
+		traceback.print_stack()
+		raise TsException(msg)
+
+	def __reset(self):
+		self.conn = None
+		self.filename = None
+		self.profile = None
+		self.cachedShiftConfig = None
+		# (sorted day numbers, { day : Snapshot }) of all snapshots.
+		# None, if not loaded.
+		self.cachedSnapshots = None
+		# Day number of the last checkpoint (-1: none).
+		# None, if unknown.
+		self.checkpointsEnd = None
+		self.databaseId = None
+		# (origin, time) of the journal entries being applied.
+		self.journalSource = None
+		self.__dayCacheReset()
+
+	@synchronized
+	def enableStats(self, enable=True):
+		"""Enable or disable the SQL statement statistics.
+		The statistics are available as self.stats."""
+		if enable and not self.stats:
+			self.stats = SqlStats()
+			self.stats.install(self.conn)
+		elif not enable and self.stats:
+			SqlStats.uninstall(self.conn)
+			self.stats = None
+
+	def operation(self, name):
+		"""Returns a context manager that attributes the statements
+		of the calling thread to the operation 'name'."""
+		stats = self.stats
+		if stats is None:
+			return self.NO_OPERATION
+		return stats.operation(name)
+
+	def addChangeCallback(self, callback):
+		"""Register a callback that is called on database modifications.
+		The callback is called as callback(table, date).
+		date is None, if the whole table (or database) changed."""
+		self.changeCallbacks.append(callback)
+
+	def __notifyChange(self, table, date):
+		# Called with the lock held.
+		if table in self.ACCOUNT_TABS:
+			self.__invalidateCheckpoints(date)
+		if self.batchLevel:
+			# Deferred to the end of the batch.
+			self.batchChanges[(table, date)] = None
+			return
+		self.__callChangeCallbacks(table, date)
+
+	def __callChangeCallbacks(self, table, date):
+		for callback in self.changeCallbacks:
+			callback(table, date)
+
+	@contextlib.contextmanager
+	def batch(self):
+		"""Group all modifications done in the 'with' block into
+		one SAVEPOINT. The modifications are rolled back, if the
+		block raises an exception. Change callbacks and the commit
+		are deferred to the end of the outermost batch."""
+		self.lock.acquire()
+		self.batchLevel += 1
+		savepoint = "batch%d" % self.batchLevel
+		try:
+			c = self.conn.cursor()
+			if not self.conn.in_transaction:
+				# Releasing an outermost SAVEPOINT commits.
+				# Nest it in a transaction, so that the
+				# (scheduled) commit stays in charge.
+				c.execute("BEGIN;")
+			c.execute("SAVEPOINT %s;" % savepoint)
+			try:
+				yield self
+			except BaseException as e:
+				c.execute("ROLLBACK TO %s;" % savepoint)
+				c.execute("RELEASE %s;" % savepoint)
+				# The write-through cache is stale now.
+				self.__dayCacheReset()
+				self.cachedShiftConfig = None
+				self.cachedSnapshots = None
+				self.checkpointsEnd = None
+				self.batchChanges[(None, None)] = None
+				raise
+			c.execute("RELEASE %s;" % savepoint)
+		except sql.Error as e:
+			self.__sqlError(e)
+		finally:
+			self.batchLevel -= 1
+			changes, commitPending = None, False
+			if not self.batchLevel:
+				changes, self.batchChanges = self.batchChanges, {}
+				commitPending, self.batchCommitPending = \
+					self.batchCommitPending, False
+			self.lock.release()
+			if changes is not None:
+				for (table, date) in changes:
+					self.__callChangeCallbacks(table, date)
+				if commitPending:
+					self.scheduleCommit()
+
+	def __dayCacheReset(self):
+		# The day-state cache holds DayTable blocks of
+		# DAYCACHE_BLOCKDAYS days, keyed by the block number.
+		# Blocks are loaded with loadRange() and
+		# kept up to date by the setters.
+		self.dayCache = {}
+
+	def __dayCacheLoad(self, blockNr):
+		beginDay = blockNr * self.DAYCACHE_BLOCKDAYS
+		block = self.loadRange(dayToDate(beginDay),
+			dayToDate(beginDay + self.DAYCACHE_BLOCKDAYS - 1))
+		self.dayCache[blockNr] = block
+		return block
+
+	def __dayCacheGet(self, table, date):
+		day = dateToDay(date)
+		blockNr = day // self.DAYCACHE_BLOCKDAYS
+		block = self.dayCache.get(blockNr)
+		if block is None:
+			block = self.__dayCacheLoad(blockNr)
+		column, decode = self.DAYTABLE_COLUMNS[table]
+		return getattr(block, column)[day - block.beginDay]
+
+	def __dayCacheSet(self, table, date, value):
+		day = dateToDay(date)
+		block = self.dayCache.get(day // self.DAYCACHE_BLOCKDAYS)
+		if block is None:
+			return # Not cached. Will be loaded from the db.
+		column, decode = self.DAYTABLE_COLUMNS[table]
+		if value is not None:
+			value = decode(value)
+		getattr(block, column)[day - block.beginDay] = value
+
+	def prefetchRange(self, beginDate, endDate):
+		"""Load the day-state cache between beginDate and endDate
+		(both inclusive). A cache miss waits for the database lock,
+		which a background commit may hold for a long time."""
+		for blockNr in range(dateToDay(beginDate) // self.DAYCACHE_BLOCKDAYS,
+				     dateToDay(endDate) // self.DAYCACHE_BLOCKDAYS + 1):
+			if blockNr not in self.dayCache:
+				self.__dayCacheLoad(blockNr)
+
+	@synchronized
+	def loadRange(self, beginDate, endDate):
+		"""Load all per-date data between beginDate and endDate
+		(both inclusive) with one query. Returns a DayTable."""
+		table = DayTable(beginDate,
+				 max(dateToDay(endDate) - dateToDay(beginDate) + 1, 0))
+		query = " UNION ALL ".join(
+			"SELECT %d, CAST(date AS INTEGER), %s FROM %s "
+			"WHERE (date>=? AND date<=?)" % (i, valCol, tab)
+			for (i, (tab, valCol, col, decode))
+			in enumerate(self.DAYTABLE_TABS))
+		try:
+			c = self.conn.cursor()
+			c.execute(query + ";", (beginDate, endDate) * len(self.DAYTABLE_TABS))
+			columns = [ (getattr(table, col), decode)
+				    for (tab, valCol, col, decode)
+				    in self.DAYTABLE_TABS ]
+			beginDay = table.beginDay
+			for (i, dateId, value) in c.fetchall():
+				column, decode = columns[i]
+				try:
+					value = decode(value)
+				except (ValueError, TypeError) as e:
+					continue
+				column[dateId - beginDay] = value
+		except sql.Error as e:
+			self.__sqlError(e)
+		return table
+
+	def __close(self):
+		if not self.conn:
+			return
+		try:
+			if not self.isInMemory():
+				printInfo("Closing database...")
+				self.commit()
+				self.__reclaimSpace(self.conn)
+				c = self.conn.cursor()
+				if self.profile == self.PROFILE_FAST:
+					c.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+				self.commit()
+			self.conn.close()
+			self.__reset()
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	@synchronized
+	def close(self):
+		self.__close()
+		self.open(self.INMEM)
+
+	@synchronized
+	def open(self, filename, profile=DEFAULT_PROFILE):
+		if profile not in self.PROFILES:
+			raise TsException("Unknown database profile '%s'" % profile)
+		try:
+			self.__close()
+			self.conn = sql.connect(str(filename),
+				detect_types=sql.PARSE_DECLTYPES,
+				check_same_thread=False)
+			if self.stats:
+				self.stats.install(self.conn)
+			self.filename = filename
+			# Check the version first. A foreign or unsupported
+			# database must not be modified.
+			if not self.isInMemory():
+				dbVer = self.__checkDatabaseVersion()
+			self.__setAutoVacuum(self.conn)
+			if not self.isInMemory():
+				self.__applyProfile(profile)
+			self.__initTables(self.conn)
+			if self.isInMemory():
+				self.__setDatabaseVersion()
+			elif dbVer < self.VERSION:
+				self.__migrateDatabase(dbVer)
+			# Load the caches that are read without the lock.
+			self.__loadShiftConfigItems()
+			self.__loadSnapshots()
+			self.__notifyChange(None, None)
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	def __applyProfile(self, profile):
+		pragmas = self.PROFILES[profile]
+		c = self.conn.cursor()
+		for (pragma, value) in pragmas:
+			c.execute("PRAGMA %s=%s;" % (pragma, value))
+			c.fetchall()
+		self.profile = profile
+
+	@classmethod
+	def __reclaimSpace(cls, conn, threshold=RECLAIM_THRESHOLD,
+			   maxPages=RECLAIM_MAX_PAGES):
+		# Reclaim free pages, if the waste exceeds the threshold.
+		# Returns the number of freed pages.
+		def pragma(name):
+			c.execute("PRAGMA %s;" % name)
+			return c.fetchone()[0]
+		conn.commit()
+		c = conn.cursor()
+		freePages = pragma("freelist_count")
+		nrPages = pragma("page_count")
+		if not freePages or freePages < nrPages * threshold:
+			return 0
+		freed = 0
+		while freePages and (maxPages is None or freed < maxPages):
+			step = cls.RECLAIM_STEP_PAGES
+			if maxPages is not None:
+				step = min(step, maxPages - freed)
+			c.execute("PRAGMA incremental_vacuum(%d);" % step)
+			c.fetchall()
+			conn.commit()
+			newFreePages = pragma("freelist_count")
+			if newFreePages >= freePages:
+				break # auto_vacuum is not enabled.
+			freed += freePages - newFreePages
+			freePages = newFreePages
+		printInfo("Reclaimed %d of %d database pages." % (freed, nrPages))
+		return freed
+
+	@synchronized
+	def reclaimSpace(self, threshold=RECLAIM_THRESHOLD,
+			 maxPages=RECLAIM_MAX_PAGES):
+		"""Reclaim free database pages, if more than 'threshold'
+		of the pages are free. Returns the number of freed pages."""
+		try:
+			return self.__reclaimSpace(self.conn, threshold, maxPages)
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	@staticmethod
+	def __setAutoVacuum(conn):
+		# Switch the database to incremental auto-vacuum, so that
+		# free pages can be reclaimed without a full VACUUM.
+		# Existing databases need a one-time VACUUM for the switch.
+		c = conn.cursor()
+		c.execute("PRAGMA auto_vacuum;")
+		if c.fetchone()[0] == 2:
+			return
+		c.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+		c.execute("SELECT COUNT(*) FROM sqlite_master;")
+		if c.fetchone()[0]:
+			printInfo("Enabling incremental auto-vacuum...")
+			c.execute("VACUUM;")
+
+	def __setDatabaseVersion(self):
+		try:
+			self.__setParameter("dbVersion", self.VERSION)
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	def __checkDatabaseVersion(self):
+		try:
+			dbVer = int(self.__getParameter("dbVersion"), 10)
+			if dbVer not in self.COMPAT_VERSIONS:
+				raise TsException("Unsupported database "
+					"version v%d" % dbVer)
+			return dbVer
+		except sql.Error as e:
+			self.__sqlError(e)
+		except ValueError as e:
+			raise TsException("Invalid database version info")
+
+	def __migrateDatabase(self, dbVer):
+		printInfo("Migrating database v%d -> v%d..." % (dbVer, self.VERSION))
+		try:
+			self.conn.commit()
+			c = self.conn.cursor()
+			c.execute("BEGIN;")
+			if dbVer < 3:
+				self.__migrateV2toV3(c)
+			if dbVer < 4:
+				self.__migrateV3toV4(c)
+			# v5 adds the checkpoints table and v6 the journal.
+			# They are created on open.
+			self.__setDatabaseVersion()
+			self.conn.commit()
+		except sql.Error as e:
+			self.conn.rollback()
+			self.__sqlError(e)
+
+	def __migrateV2toV3(self, c):
+		# v3 adds primary keys and typed value columns.
+		# The value affinity of the new columns converts the
+		# TEXT values. The last row wins on duplicate keys.
+		for tabSignature in self.TABS:
+			if tabSignature in (self.TAB_checkpts, self.TAB_journal):
+				continue # Added in v5 and v6.
+			tabName, columns = self.__tabInfo(tabSignature)
+			columns = ", ".join(columns)
+			c.execute("ALTER TABLE %s RENAME TO %s_v2;" % (tabName, tabName))
+			c.execute("CREATE TABLE %s;" % tabSignature)
+			c.execute("INSERT OR REPLACE INTO %s(%s) "
+				  "SELECT %s FROM %s_v2 ORDER BY rowid;" %\
+				  (tabName, columns, columns, tabName))
+			c.execute("DROP TABLE %s_v2;" % tabName)
+
+	def __migrateV3toV4(self, c):
+		# v4 keys the rows by day number instead of the
+		# local time milliseconds ID. Day numbers and millisecond
+		# IDs of any sane date never collide.
+		# Snapshot blobs keep their encoding. Snapshot.fromBytes()
+		# decodes the old date IDs.
+		# Two IDs of the same day (e.g. different time zones) are
+		# merged into one row. The row with the later ID wins.
+		self.conn.create_function("msecsIdToDay", 1,
+			lambda idNum: dateToDay(msecsIdToDate(idNum)))
+		signatures = { self.__tabInfo(tabSignature)[0] : tabSignature
+			       for tabSignature in self.TABS }
+		for (tabName, valCol, col, decode) in self.DAYTABLE_TABS:
+			tabSignature = signatures[tabName]
+			columns = self.__tabInfo(tabSignature)[1]
+			values = ", ".join("msecsIdToDay(date)" if column == "date"
+					   else column for column in columns)
+			c.execute("ALTER TABLE %s RENAME TO %s_v3;" % (tabName, tabName))
+			c.execute("CREATE TABLE %s;" % tabSignature)
+			c.execute("INSERT OR REPLACE INTO %s(%s) "
+				  "SELECT %s FROM %s_v3 ORDER BY date;" %\
+				  (tabName, ", ".join(columns), values, tabName))
+			c.execute("DROP TABLE %s_v3;" % tabName)
+
+	def getFilename(self):
+		return self.filename
+
+	def isInMemory(self):
+		return self.filename == self.INMEM
+
+	@synchronized
+	def commit(self):
+		try:
+			self.conn.commit()
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	def scheduleCommit(self, msec=5000):
+		if self.batchLevel:
+			self.batchCommitPending = True
+			return
+		self.startCommitTimer(msec)
+
+	def startCommitTimer(self, msec):
+		"""Commit the database in 'msec' milliseconds.
+		The core doesn't have an event loop. It commits on close.
+		Frontends with an event loop override this."""
+		pass
+
+	def __initTables(self, conn):
+		script = [ "CREATE TABLE IF NOT EXISTS %s;" % tabSignature
+			   for tabSignature in self.TABS ]
+		script.extend("CREATE INDEX IF NOT EXISTS %s;" % index
+			      for index in self.INDEXES)
+		conn.cursor().executescript("\n".join(script))
+		conn.commit()
+
+	@staticmethod
+	def __tabInfo(tabSignature):
+		# Returns the table name and the list of column names.
+		tabName = tabSignature.split("(")[0].strip()
+		columns = tabSignature.split("(")[1].split(")")[0]
+		columns = [ c.split()[0] for c in columns.split(",") ]
+		return tabName, columns
+
+	@synchronized
+	def resetDatabase(self):
+		self.__dayCacheReset()
+		self.cachedShiftConfig = None
+		self.cachedSnapshots = None
+		self.conn.cursor().executescript("""
+			DROP TABLE IF EXISTS params;
+			DROP TABLE IF EXISTS dayFlags;
+			DROP TABLE IF EXISTS override_dayType;
+			DROP TABLE IF EXISTS override_shift;
+			DROP TABLE IF EXISTS override_workTime;
+			DROP TABLE IF EXISTS override_breakTime;
+			DROP TABLE IF EXISTS override_attendanceTime;
+			DROP TABLE IF EXISTS snapshots;
+			DROP TABLE IF EXISTS comments;
+			DROP TABLE IF EXISTS shiftConfig;
+			DROP TABLE IF EXISTS presets;
+			DROP TABLE IF EXISTS checkpoints;
+			DROP TABLE IF EXISTS journal;
+		""")
+		self.conn.commit()
+		self.__reclaimSpace(self.conn, maxPages=None)
+		self.__initTables(self.conn)
+		self.__setDatabaseVersion()
+		self.databaseId = None
+		self.checkpointsEnd = None
+		self.conn.commit()
+		self.__notifyChange(None, None)
+
+	@synchronized
+	def clone(self, target, progress=None):
+		"""Copy the database to the file 'target' with the
+		sqlite online backup API. An existing file is overwritten.
+		'progress' is called as progress(copiedPages, totalPages)
+		after each step."""
+		def backupProgress(status, remaining, total):
+			if progress:
+				progress(total - remaining, total)
+		try:
+			self.commit()
+			cloneconn = sql.connect(str(target))
+			try:
+				self.conn.backup(cloneconn,
+						 pages=self.CLONE_STEP_PAGES,
+						 progress=backupProgress)
+				# The copy gets its own ID for syncing.
+				cloneconn.execute("DELETE FROM params WHERE name=?;",
+						  (self.PARAM_DBID,))
+				cloneconn.commit()
+				self.__reclaimSpace(cloneconn)
+			finally:
+				cloneconn.close()
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	@synchronized
+	def backup(self, progress=None):
+		"""Write a backup copy next to the database file.
+		Returns the backup file name."""
+		if self.isInMemory():
+			raise TsException("In-memory databases can't be backed up.")
+		target = str(self.filename) + ".bak"
+		self.clone(target, progress)
+		return target
+
+	def __setParameter(self, param, value):
+		try:
+			c = self.conn.cursor()
+			if value is None:
+				c.execute("DELETE FROM params WHERE name=?;", (str(param),))
+			else:
+				c.execute("INSERT OR REPLACE INTO params(name, data) "
+					  "VALUES(?, ?);",
+					  (str(param), str(value)))
+			self.scheduleCommit()
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	def __getParameter(self, param):
+		try:
+			c = self.conn.cursor()
+			c.execute("SELECT data FROM params WHERE name=?;", (param,))
+			value = c.fetchone()
+			if value:
+				return value[0]
+			return None
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	@synchronized
+	def setDayFlags(self, date, value):
+		value = int(value) & 0xFFFFFFFF
+		oldValue = self.getDayFlags(date)
+		if value == oldValue:
+			return
+		try:
+			c = self.conn.cursor()
+			c.execute("INSERT OR REPLACE INTO dayFlags(date, value) "
+				  "VALUES(?, ?);",
+				  (date, value))
+			self.__journal((("dayFlags", date, oldValue, value),))
+			self.__dayCacheSet("dayFlags", date, value)
+			self.__notifyChange("dayFlags", date)
+			self.scheduleCommit()
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	def getDayFlags(self, date):
+		return self.__dayCacheGet("dayFlags", date)
+
+	@synchronized
+	def __setOverrides(self, table, dateValues):
+		# Set the override values for a sequence of (date, value) tuples.
+		# Unchanged values are skipped. All new values are written
+		# with one statement and all removals with another one.
+		column, decode = self.DAYTABLE_COLUMNS[table]
+		changed = [ (date, value, self.__dayCacheGet(table, date))
+			    for (date, value) in dateValues ]
+		changed = [ (date, value, oldValue)
+			    for (date, value, oldValue) in changed
+			    if (None if value is None else decode(value)) != oldValue ]
+		if not changed:
+			return
+		try:
+			c = self.conn.cursor()
+			c.executemany("INSERT OR REPLACE INTO %s(date, value) "
+				      "VALUES(?, ?);" % table,
+				      [ (date, value) for (date, value, oldValue) in changed
+					if value is not None ])
+			c.executemany("DELETE FROM %s WHERE date=?;" % table,
+				      [ (date,) for (date, value, oldValue) in changed
+					if value is None ])
+			self.__journal((table, date, oldValue, value)
+				       for (date, value, oldValue) in changed)
+			for (date, value, oldValue) in changed:
+				self.__dayCacheSet(table, date, value)
+				self.__notifyChange(table, date)
+			self.scheduleCommit()
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	def __setOverride(self, table, date, value):
+		self.__setOverrides(table, ((date, value),))
+
+	def __getOverride(self, table, date):
+		return self.__dayCacheGet(table, date)
+
+	def __hasOverride(self, table, date):
+		return self.__dayCacheGet(table, date) is not None
+
+	def setDayTypeOverride(self, date, daytype):
+		self.__setOverride("override_dayType", date, daytype)
+
+	def setDayTypeOverrides(self, dateValues):
+		self.__setOverrides("override_dayType", dateValues)
+
+	def hasDayTypeOverride(self, date):
+		return self.__hasOverride("override_dayType", date)
+
+	def getDayTypeOverride(self, date):
+		return self.__getOverride("override_dayType", date)
+
+	@synchronized
+	def findDayTypeDates(self, daytype, beginDate, endDate):
+		# Find all dates with the specified "daytype" between
+		# "beginDate" and "endDate".
+		# XXX: Currently unused.
+		try:
+			c = self.conn.cursor()
+			c.execute("""
+				SELECT date FROM override_dayType WHERE
+				(value=? AND date>=? AND date<=?);
+			""", (daytype, beginDate, endDate))
+			dates = c.fetchall()
+			return [ d[0] for d in dates ]
+		except (ValueError, TypeError) as e:
+			return None
+
+	def setShiftOverride(self, date, shift):
+		self.__setOverride("override_shift", date, shift)
+
+	def setShiftOverrides(self, dateValues):
+		self.__setOverrides("override_shift", dateValues)
+
+	def hasShiftOverride(self, date):
+		return self.__hasOverride("override_shift", date)
+
+	def getShiftOverride(self, date):
+		return self.__getOverride("override_shift", date)
+
+	def setWorkTimeOverride(self, date, workTime):
+		self.__setOverride("override_workTime", date, workTime)
+
+	def hasWorkTimeOverride(self, date):
+		return self.__hasOverride("override_workTime", date)
+
+	def getWorkTimeOverride(self, date):
+		return self.__getOverride("override_workTime", date)
+
+	def setBreakTimeOverride(self, date, breakTime):
+		self.__setOverride("override_breakTime", date, breakTime)
+
+	def hasBreakTimeOverride(self, date):
+		return self.__hasOverride("override_breakTime", date)
+
+	def getBreakTimeOverride(self, date):
+		return self.__getOverride("override_breakTime", date)
+
+	def setAttendanceTimeOverride(self, date, attendanceTime):
+		self.__setOverride("override_attendanceTime", date, attendanceTime)
+
+	def hasAttendanceTimeOverride(self, date):
+		return self.__hasOverride("override_attendanceTime", date)
+
+	def getAttendanceTimeOverride(self, date):
+		return self.__getOverride("override_attendanceTime", date)
+
+	@synchronized
+	def setShiftConfigItems(self, items):
+		# The callers modify the cached items in place.
+		# Compare with the stored encoding instead of the cache.
+		newValue = packList(items, ShiftConfigItem.toBytes)
+		try:
+			c = self.conn.cursor()
+			c.execute('SELECT CAST(item AS BLOB) FROM shiftConfig ORDER BY "idx";')
+			oldValue = packList((row[0] for row in c.fetchall()), bytes)
+			self.cachedShiftConfig = items
+			if newValue == oldValue:
+				return
+			# The shift configuration dialog writes on every
+			# input change. Merge consecutive local changes
+			# into one journal entry.
+			self.__journal((("shiftConfig", None, oldValue, newValue),),
+				       coalesce=True)
+			c.execute("DROP TABLE IF EXISTS shiftConfig;")
+			c.execute("CREATE TABLE %s;" % self.TAB_shconf)
+			for (index, item) in enumerate(items):
+				c.execute("INSERT INTO shiftConfig(idx, item) VALUES(?, ?);",
+					  (index, item))
+			self.__notifyChange("shiftConfig", None)
+			self.scheduleCommit()
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	def getShiftConfigItems(self):
+		# Doesn't take the lock, if the items are cached.
+		items = self.cachedShiftConfig
+		if items is not None:
+			return items
+		return self.__loadShiftConfigItems()
+
+	@synchronized
+	def __loadShiftConfigItems(self):
+		try:
+			c = self.conn.cursor()
+			c.execute("CREATE TABLE IF NOT EXISTS %s;" % self.TAB_shconf)
+			c.execute('SELECT item FROM shiftConfig ORDER BY "idx";')
+			items = c.fetchall()
+			items = [ i[0] for i in items ]
+			self.cachedShiftConfig = items
+			return items
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	@synchronized
+	def setPresets(self, presets):
+		newValue = packList(presets, Preset.toBytes)
+		try:
+			c = self.conn.cursor()
+			c.execute('SELECT CAST(preset AS BLOB) FROM presets ORDER BY "idx";')
+			oldValue = packList((row[0] for row in c.fetchall()), bytes)
+			if newValue == oldValue:
+				return
+			# The preset dialog writes on every input change.
+			# Merge consecutive local changes into one journal entry.
+			self.__journal((("presets", None, oldValue, newValue),),
+				       coalesce=True)
+			c.execute("DROP TABLE IF EXISTS presets;")
+			c.execute("CREATE TABLE %s;" % self.TAB_presets)
+			for (index, preset) in enumerate(presets):
+				c.execute("INSERT INTO presets(idx, preset) VALUES(?, ?);",
+					  (index, preset))
+			self.scheduleCommit()
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	@synchronized
+	def getPresets(self):
+		try:
+			c = self.conn.cursor()
+			c.execute("CREATE TABLE IF NOT EXISTS %s;" % self.TAB_presets)
+			c.execute('SELECT preset FROM presets ORDER BY "idx";')
+			presets = c.fetchall()
+			return [ p[0] for p in presets ]
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	@synchronized
+	def setSnapshot(self, date, snapshot):
+		oldSnapshot = self.getSnapshot(date)
+		try:
+			self.__journal((("snapshots", date, oldSnapshot, snapshot),))
+			c = self.conn.cursor()
+			if snapshot is None:
+				c.execute("DELETE FROM snapshots WHERE date=?;", (date,))
+			else:
+				c.execute("INSERT OR REPLACE INTO snapshots(date, snapshot) "
+					  "VALUES(?, ?);",
+					  (date, snapshot))
+			self.__dayCacheSet("snapshots", date,
+					   0 if snapshot is None else 1)
+			# Replace the snapshot cache. Readers don't take the lock.
+			# Cache a decoded copy, like a database read returns it.
+			days, snapshots = self.__getSnapshots()
+			snapshots = dict(snapshots)
+			if snapshot is None:
+				snapshots.pop(dateToDay(date), None)
+			else:
+				snapshots[dateToDay(date)] = \
+					Snapshot.fromBytes(Snapshot.toBytes(snapshot))
+			self.cachedSnapshots = (sorted(snapshots), snapshots)
+			self.__notifyChange("snapshots", date)
+			self.scheduleCommit()
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	def hasSnapshot(self, date):
+		return bool(self.__dayCacheGet("snapshots", date))
+
+	def __getSnapshots(self):
+		# The snapshot cache is replaced on changes, but never
+		# modified. So it can be read without the lock.
+		cache = self.cachedSnapshots
+		if cache is None:
+			cache = self.__loadSnapshots()
+		return cache
+
+	@synchronized
+	def __loadSnapshots(self):
+		try:
+			c = self.conn.cursor()
+			c.execute("SELECT CAST(date AS INTEGER), snapshot FROM snapshots;")
+			snapshots = dict(c.fetchall())
+			self.cachedSnapshots = (sorted(snapshots), snapshots)
+			return self.cachedSnapshots
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	def getSnapshot(self, date):
+		days, snapshots = self.__getSnapshots()
+		return snapshots.get(dateToDay(date))
+
+	def getAllSnapshots(self):
+		"""Returns all snapshots in date order."""
+		days, snapshots = self.__getSnapshots()
+		return [ snapshots[day] for day in days ]
+
+	def findSnapshotForDate(self, date):
+		# Get the snapshot that is active for a certain date.
+		days, snapshots = self.__getSnapshots()
+		i = bisect.bisect_right(days, dateToDay(date))
+		return snapshots[days[i - 1]] if i else None
+
+	def setComment(self, date, comment):
+		self.setComments(((date, comment),))
+
+	@synchronized
+	def setComments(self, dateComments):
+		# Set the comments for a sequence of (date, comment) tuples.
+		# An empty comment removes the comment.
+		# Unchanged comments are skipped.
+		changed = [ (date, str(comment) if comment else None,
+			     self.getComment(date) if self.hasComment(date) else None)
+			    for (date, comment) in dateComments ]
+		changed = [ (date, comment, oldComment)
+			    for (date, comment, oldComment) in changed
+			    if comment != oldComment ]
+		if not changed:
+			return
+		try:
+			self.__journal(("comments", date, oldComment, comment)
+				       for (date, comment, oldComment) in changed)
+			c = self.conn.cursor()
+			c.executemany("INSERT OR REPLACE INTO comments(date, comment) "
+				      "VALUES(?, ?);",
+				      [ (date, comment)
+					for (date, comment, oldComment) in changed
+					if comment ])
+			c.executemany("DELETE FROM comments WHERE date=?;",
+				      [ (date,) for (date, comment, oldComment) in changed
+					if not comment ])
+			for (date, comment, oldComment) in changed:
+				self.__dayCacheSet("comments", date,
+						   1 if comment else 0)
+				self.__notifyChange("comments", date)
+			self.scheduleCommit()
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	def hasComment(self, date):
+		return bool(self.__dayCacheGet("comments", date))
+
+	@synchronized
+	def getComment(self, date):
+		try:
+			c = self.conn.cursor()
+			c.execute("SELECT comment FROM comments WHERE date=?;", (date,))
+			comment = c.fetchone()
+			if comment:
+				comment = comment[0]
+			return comment
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	@synchronized
+	def getCheckpoints(self):
+		"""Returns all account checkpoints as a dict
+		dayNumber -> (snapshotDay, shiftConfigIndex, account, holidays)."""
+		try:
+			c = self.conn.cursor()
+			c.execute("SELECT CAST(date AS INTEGER), "
+				  "CAST(snapshotDate AS INTEGER), "
+				  "shiftConfigIndex, account, holidays "
+				  "FROM checkpoints;")
+			return { row[0] : row[1:] for row in c.fetchall() }
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	@synchronized
+	def setCheckpoints(self, checkpoints):
+		"""Store account checkpoints. 'checkpoints' is a sequence of
+		(dayNumber, (snapshotDay, shiftConfigIndex, account, holidays)).
+		Checkpoints are derived data. They don't trigger change
+		callbacks and are committed with the next commit."""
+		checkpoints = [ (day,) + tuple(cp) for (day, cp) in checkpoints ]
+		if not checkpoints:
+			return
+		try:
+			c = self.conn.cursor()
+			c.executemany("INSERT OR REPLACE INTO checkpoints"
+				      "(date, snapshotDate, shiftConfigIndex, "
+				      "account, holidays) VALUES(?, ?, ?, ?, ?);",
+				      checkpoints)
+			if self.checkpointsEnd is not None:
+				self.checkpointsEnd = max(self.checkpointsEnd,
+					max(cp[0] for cp in checkpoints))
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	@synchronized
+	def removeCheckpoints(self, afterDate=None):
+		"""Remove the account checkpoints after 'afterDate'
+		or all checkpoints, if 'afterDate' is None."""
+		try:
+			c = self.conn.cursor()
+			if afterDate is None:
+				c.execute("DELETE FROM checkpoints;")
+				self.checkpointsEnd = -1
+			else:
+				day = dateToDay(afterDate)
+				c.execute("DELETE FROM checkpoints WHERE date>?;",
+					  (day,))
+				if self.checkpointsEnd is not None:
+					self.checkpointsEnd = min(self.checkpointsEnd, day)
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	def __invalidateCheckpoints(self, date):
+		# The state at the start of a day depends on all days before
+		# it. Remove the checkpoints after the changed date, or all
+		# of them for whole-table changes. This runs for every writer,
+		# so that no stale checkpoints are left in the file.
+		if self.checkpointsEnd is None:
+			c = self.conn.cursor()
+			c.execute("SELECT CAST(MAX(date) AS INTEGER) FROM checkpoints;")
+			end = c.fetchone()[0]
+			self.checkpointsEnd = -1 if end is None else end
+		if self.checkpointsEnd < 0 or\
+		   (date is not None and dateToDay(date) >= self.checkpointsEnd):
+			return # Nothing to remove.
+		self.removeCheckpoints(date)
+
+	def __journal(self, entries, coalesce=False):
+		# Append (table, date, oldValue, newValue) entries
+		# to the change journal.
+		# With 'coalesce', a single local entry replaces the last
+		# journal entry, if that is a local change of the same value.
+		# The replacement gets a new sequence number, so that peers
+		# which already received the old entry get the new one, too.
+		origin, when = self.journalSource or\
+			       (self.getDatabaseId(), time.time())
+		c = self.conn.cursor()
+		if coalesce and not self.journalSource:
+			((table, date, oldValue, newValue),) = entries
+			c.execute("SELECT seq, origin, tableName, date, oldValue "
+				  "FROM journal ORDER BY seq DESC LIMIT 1;")
+			last = c.fetchone()
+			if last and tuple(last[1:4]) == (origin, table, date):
+				c.execute("DELETE FROM journal WHERE seq=?;", (last[0],))
+				entries = ((table, date, last[4], newValue),)
+		c.executemany("INSERT INTO journal(origin, time, tableName, "
+			      "date, oldValue, newValue) VALUES(?, ?, ?, ?, ?, ?);",
+			      [ (origin, when, table, date, oldValue, newValue)
+				for (table, date, oldValue, newValue) in entries ])
+
+	@synchronized
+	def getDatabaseId(self):
+		"""Returns the random ID of the database.
+		The journal entries written by this database carry the ID."""
+		if self.databaseId is None:
+			dbId = self.__getParameter(self.PARAM_DBID)
+			if not dbId:
+				dbId = self.newDatabaseId()
+			self.databaseId = dbId
+		return self.databaseId
+
+	@synchronized
+	def newDatabaseId(self):
+		"""Assign a new random ID. A plain file copy of a database
+		needs a new ID before it can be synced with the original."""
+		import os
+		dbId = os.urandom(8).hex()
+		self.__setParameter(self.PARAM_DBID, dbId)
+		self.databaseId = dbId
+		return dbId
+
+	@synchronized
+	def getSyncSeq(self, peerId):
+		"""Returns the last journal sequence number of the
+		peer database that was merged into this database."""
+		seq = self.__getParameter(self.PARAM_SYNCSEQ + peerId)
+		return int(seq) if seq else 0
+
+	@synchronized
+	def getJournal(self, sinceSeq=0, excludeOrigin=None):
+		"""Returns the journal entries after 'sinceSeq' as list of
+		(seq, origin, time, table, dayNumber, newValue) tuples.
+		Entries written by 'excludeOrigin' are skipped."""
+		try:
+			c = self.conn.cursor()
+			c.execute("SELECT seq, origin, time, tableName, "
+				  "CAST(date AS INTEGER), newValue FROM journal "
+				  "WHERE seq>? AND origin IS NOT ? ORDER BY seq;",
+				  (sinceSeq, excludeOrigin))
+			return c.fetchall()
+		except sql.Error as e:
+			self.__sqlError(e)
+
+	@synchronized
+	def applyJournal(self, peerId, entries):
+		"""Merge the getJournal() entries of the peer database.
+		A change is applied, if it is newer than the latest local
+		change of the same value (last writer wins).
+		Returns the number of applied changes."""
+		applied, lastSeq = 0, self.getSyncSeq(peerId)
+		with self.batch():
+			try:
+				c = self.conn.cursor()
+				for (seq, origin, when, table, day, value) in entries:
+					lastSeq = max(lastSeq, seq)
+					c.execute("SELECT time, origin FROM journal "
+						  "WHERE tableName=? AND date IS ? "
+						  "ORDER BY time DESC, origin DESC LIMIT 1;",
+						  (table, day))
+					latest = c.fetchone()
+					if latest and tuple(latest) >= (when, origin):
+						continue
+					self.journalSource = (origin, when)
+					try:
+						self.__applyJournalEntry(table,
+							None if day is None else dayToDate(day),
+							value)
+					finally:
+						self.journalSource = None
+					applied += 1
+				self.__setParameter(self.PARAM_SYNCSEQ + peerId, lastSeq)
+			except sql.Error as e:
+				self.__sqlError(e)
+		return applied
+
+	def __applyJournalEntry(self, table, date, value):
+		if table == "dayFlags":
+			self.setDayFlags(date, value or 0)
+		elif table == "comments":
+			self.setComments(((date, value),))
+		elif table == "snapshots":
+			self.setSnapshot(date, None if value is None else\
+					 Snapshot.fromBytes(value))
+		elif table == "shiftConfig":
+			self.setShiftConfigItems(unpackList(value,
+						 ShiftConfigItem.fromBytes))
+		elif table == "presets":
+			self.setPresets(unpackList(value, Preset.fromBytes))
+		elif table in self.DAYTABLE_COLUMNS:
+			self.__setOverrides(table, ((date, value),))
+		else:
+			raise TsException("Unknown journal table '%s'" % table)
+
+	def iterDayValues(self, tables, beginDate, endDate):
+		"""Iterate over the per-date values of 'tables' between
+		beginDate and endDate (both inclusive) in date order.
+		Yields (dayNumber, values) for each date with at least one
+		value. 'values' is a tuple with one entry per table.
+		Missing values are None. Comments are returned as text."""
+		query = " UNION ALL ".join(
+			"SELECT CAST(date AS INTEGER) AS d, %d AS i, %s AS v FROM %s "
+			"WHERE (date>=? AND date<=?)" %\
+			(i, "comment" if tab == "comments" else "value", tab)
+			for (i, tab) in enumerate(tables))
+		decoders = [ str if tab == "comments" else self.DAYTABLE_COLUMNS[tab][1]
+			     for tab in tables ]
+		try:
+			with self.lock:
+				c = self.conn.cursor()
+				c.execute(query + " ORDER BY d, i;",
+					  (beginDate, endDate) * len(tables))
+				rows = c.fetchmany(1024)
+			day, values = None, None
+			while rows:
+				for (d, i, v) in rows:
+					if d != day:
+						if day is not None:
+							yield day, tuple(values)
+						day, values = d, [ None ] * len(tables)
+					try:
+						values[i] = decoders[i](v)
+					except (ValueError, TypeError) as e:
+						pass
+				with self.lock:
+					rows = c.fetchmany(1024)
+			if day is not None:
+				yield day, tuple(values)
+		except sql.Error as e:
+			self.__sqlError(e)
+
+def syncDatabases(db, peer):
+	"""Exchange the journal entries of the two databases that
+	were written since their last sync. Returns the number of
+	changes applied to 'db' and to 'peer'."""
+	dbId, peerId = db.getDatabaseId(), peer.getDatabaseId()
+	if dbId == peerId:
+		raise TsException("Both databases have the same ID. "
+				  "A plain file copy needs a new ID first.")
+	# Entries that originally came from the receiver are not sent back.
+	toPeer = peer.applyJournal(dbId,
+		db.getJournal(peer.getSyncSeq(dbId), excludeOrigin=peerId))
+	toDb = db.applyJournal(peerId,
+		peer.getJournal(db.getSyncSeq(peerId), excludeOrigin=dbId))
+	return (toDb, toPeer)
+
+class AccountState(object):
+	"Calculated account state."
+
+	__slots__ = ( "date", "shiftConfigIndex",
+		      "accountAtStartOfDay", "accountAtEndOfDay",
+		      "holidaysAtStartOfDay", "holidaysAtEndOfDay", )
+
+	def __init__(self, date, shiftConfigIndex=0,
+		     accountAtStartOfDay=0.0, accountAtEndOfDay=0.0,
+		     holidaysAtStartOfDay=0, holidaysAtEndOfDay=0):
+		self.date = date
+		self.shiftConfigIndex = shiftConfigIndex
+		self.accountAtStartOfDay = accountAtStartOfDay
+		self.accountAtEndOfDay = accountAtEndOfDay
+		self.holidaysAtStartOfDay = holidaysAtStartOfDay
+		self.holidaysAtEndOfDay = holidaysAtEndOfDay
+
+class AccountEngine(object):
+	"""Account state calculation.
+	The state at the start of every CHECKPOINT_DAYS'th day is stored
+	as checkpoint in the database, so that later calculations don't
+	have to walk all the way from the snapshot."""
+
+	# Distance (in days) between two account state checkpoints.
+	CHECKPOINT_DAYS = 32
+
+	ACCOUNT_TABS = TsDatabase.ACCOUNT_TABS
+
+	def __init__(self, db):
+		self.db = db
+		# Copy of the database checkpoints. Loaded on demand.
+		self.checkpoints = None
+		# The calculation may run in a worker thread.
+		# 'generation' counts the invalidations. Checkpoints of a
+		# calculation that overlapped an invalidation are dropped.
+		# Lock order: db.lock, then self.lock.
+		self.lock = threading.Lock()
+		self.generation = 0
+		db.addChangeCallback(self.__dbChanged)
+
+	def __dbChanged(self, table, date):
+		if table is not None and table not in self.ACCOUNT_TABS:
+			return
+		with self.db.lock, self.lock:
+			self.generation += 1
+			if table is None:
+				# Other database or rollback. Reload.
+				self.checkpoints = None
+			elif date is None:
+				self.db.removeCheckpoints()
+				self.checkpoints = {}
+			else:
+				# The database already removed the checkpoints after
+				# the changed day. Remove them again, because a batch
+				# calls back after releasing the lock and a calculation
+				# may have stored outdated checkpoints in between.
+				checkpoints = self.__getCheckpoints()
+				day = dateToDay(date)
+				if any(d > day for d in checkpoints):
+					self.db.removeCheckpoints(date)
+					self.checkpoints = { d : cp for (d, cp)
+							     in checkpoints.items()
+							     if d <= day }
+
+	def __getCheckpoints(self):
+		# Called with db.lock and self.lock held.
+		if self.checkpoints is None:
+			self.checkpoints = self.db.getCheckpoints()
+		return self.checkpoints
+
+	def resetCheckpoints(self):
+		"""Remove all stored checkpoints."""
+		with self.db.lock, self.lock:
+			self.generation += 1
+			self.db.removeCheckpoints()
+			self.checkpoints = {}
+
+	def __findCheckpoint(self, snapshot, date):
+		# Find the latest checkpoint between snapshot and date.
+		# Returns a tuple (day, checkpoint) or None.
+		with self.db.lock, self.lock:
+			checkpoints = self.__getCheckpoints()
+		snapshotDay = dateToDay(snapshot.date)
+		day = dateToDay(date)
+		day -= day % self.CHECKPOINT_DAYS
+		while day > snapshotDay:
+			checkpoint = checkpoints.get(day)
+			if checkpoint and checkpoint[0] == snapshotDay:
+				return (day, checkpoint)
+			day -= self.CHECKPOINT_DAYS
+		return None
+
+	def getShiftConfigIndexForDate(self, date):
+		# Find the shift config index that's valid for the date.
+		# May return -1 on error.
+		snapshot = self.db.findSnapshotForDate(date)
+		if not snapshot:
+			return -1
+		daysBetween = dateToDay(date) - dateToDay(snapshot.date)
+		assert(daysBetween >= 0)
+		index = snapshot.shiftConfigIndex
+		index += daysBetween
+		index %= len(self.db.getShiftConfigItems())
+		return index
+
+	def getShiftConfigItemForDate(self, date):
+		index = self.getShiftConfigIndexForDate(date)
+		if index >= 0:
+			return self.db.getShiftConfigItems()[index]
+		return None
+
+	def __walk(self, snapshot, startDate, endDate, generation=None):
+		# Calculate the account state from the snapshot to endDate.
+		# The calculation resumes at the latest checkpoint
+		# before startDate, if there is one.
+		# 'generation' is the generation the snapshot was read in.
+		# Yields (day, dayTable, offset, shiftConfigItem, state)
+		# for each calculated day. 'state' is updated in place and
+		# holds the state at the end of the day.
+		if generation is None:
+			generation = self.generation
+		shiftConfig = self.db.getShiftConfigItems()
+		nrShiftConfigs = len(shiftConfig)
+		state = AccountState(
+			date = snapshot.date,
+			shiftConfigIndex = snapshot.shiftConfigIndex,
+			accountAtStartOfDay = snapshot.accountValue,
+			accountAtEndOfDay = snapshot.accountValue,
+			holidaysAtStartOfDay = snapshot.holidaysLeft,
+			holidaysAtEndOfDay = snapshot.holidaysLeft
+		)
+		snapshotDay = dateToDay(snapshot.date)
+		assert(snapshotDay <= dateToDay(endDate))
+
+		# Skip ahead to the latest cached checkpoint, if any.
+		found = self.__findCheckpoint(snapshot, startDate)
+		if found:
+			day, (snapshotDay, shiftConfigIndex, account, holidays) = found
+			state.date = dayToDate(day)
+			state.shiftConfigIndex = shiftConfigIndex
+			state.accountAtStartOfDay = state.accountAtEndOfDay = account
+			state.holidaysAtStartOfDay = state.holidaysAtEndOfDay = holidays
+
+		# Load all overrides of the remaining interval at once.
+		days = self.db.loadRange(state.date, endDate)
+		newCheckpoints = []
+		for offset in range(days.nrDays):
+			if offset:
+				state.shiftConfigIndex = (state.shiftConfigIndex + 1) % nrShiftConfigs
+				state.accountAtStartOfDay = state.accountAtEndOfDay
+				state.holidaysAtStartOfDay = state.holidaysAtEndOfDay
+
+			day = days.beginDay + offset
+			if day % self.CHECKPOINT_DAYS == 0 and day > snapshotDay and\
+			   (not found or day > found[0]):
+				# Checkpoint: (snapshotDay, shiftConfigIndex,
+				#              accountAtStartOfDay, holidaysAtStartOfDay)
+				newCheckpoints.append((day, (
+					snapshotDay, state.shiftConfigIndex,
+					state.accountAtStartOfDay,
+					state.holidaysAtStartOfDay)))
+
+			shiftConfigItem = shiftConfig[state.shiftConfigIndex]
+			workTime = days.workTime[offset]
+			if workTime is None:
+				workTime = shiftConfigItem.workTime
+			breakTime = days.breakTime[offset]
+			if breakTime is None:
+				breakTime = shiftConfigItem.breakTime
+			attendanceTime = days.attendanceTime[offset]
+			if attendanceTime is None:
+				attendanceTime = shiftConfigItem.attendanceTime
+
+			dtype = days.dayType[offset]
+			if dtype is None or dtype == DTYPE_DEFAULT:
+				if attendanceTime > 0.001:
+					state.accountAtEndOfDay += attendanceTime
+					state.accountAtEndOfDay -= workTime
+					state.accountAtEndOfDay -= breakTime
+			elif dtype == DTYPE_COMPTIME:
+				state.accountAtEndOfDay -= workTime
+			elif dtype == DTYPE_HOLIDAY:
+				state.holidaysAtEndOfDay -= 1
+			elif dtype in (DTYPE_FEASTDAY, DTYPE_SHORTTIME):
+				pass # no change
+			else:
+				assert(0)
+			yield (day, days, offset, shiftConfigItem, state)
+
+		# Store the new checkpoints, unless the database
+		# changed during the calculation.
+		with self.db.lock, self.lock:
+			if generation == self.generation:
+				checkpoints = self.__getCheckpoints()
+				newCheckpoints = [ (d, cp) for (d, cp) in newCheckpoints
+						   if checkpoints.get(d) != cp ]
+				if newCheckpoints:
+					self.db.setCheckpoints(newCheckpoints)
+					checkpoints.update(newCheckpoints)
+
+	def calcAccountState(self, snapshot, endDate, generation=None):
+		"""Calculate the account state at endDate,
+		starting from the snapshot."""
+		state = None
+		for (day, days, offset, shiftConfigItem, state) in\
+				self.__walk(snapshot, endDate, endDate, generation):
+			pass
+		state.date = endDate
+		return state
+
+	def calcAccountStateForDate(self, date):
+		"""Calculate the account state at 'date' from the
+		active snapshot. Returns None, if there is no snapshot
+		or no shift configuration."""
+		generation = self.generation
+		if not self.db.getShiftConfigItems():
+			return None
+		snapshot = self.db.findSnapshotForDate(date)
+		if not snapshot:
+			return None
+		return self.calcAccountState(snapshot, date, generation)
+
+	def calcReport(self, beginDate, endDate):
+		"""Calculate the daily account report from beginDate
+		to endDate (inclusive). Each day is calculated from its
+		active snapshot. The report starts at the first snapshot,
+		if beginDate is before it. Returns an AccountReport."""
+		shiftConfig = self.db.getShiftConfigItems()
+		if not shiftConfig:
+			raise TsException("No shift configuration")
+		beginDay, endDay = dateToDay(beginDate), dateToDay(endDate)
+		if endDay < beginDay:
+			raise TsException("End date before begin date")
+		snapshots = { dateToDay(s.date) : s
+			      for s in self.db.getAllSnapshots() }
+		snapshot = self.db.findSnapshotForDate(beginDate)
+		if not snapshot:
+			# The account starts with the first snapshot.
+			firstDay = min((d for d in snapshots if d <= endDay),
+				       default=None)
+			if firstDay is None:
+				raise TsException("No snapshot before %s" %\
+						  formatDate(endDate))
+			snapshot = snapshots[firstDay]
+			beginDate, beginDay = dayToDate(firstDay), firstDay
+
+		# Load everything from the active snapshot on at once
+		# and calculate the columns with list operations.
+		days = self.db.loadRange(snapshot.date, endDate)
+		loadDay = days.beginDay
+		segmentDays = sorted(d for d in snapshots
+				     if loadDay <= d <= endDay)
+
+		nrShiftConfigs = len(shiftConfig)
+		index = []
+		for (i, d) in enumerate(segmentDays):
+			segmentEnd = segmentDays[i + 1] if i + 1 < len(segmentDays)\
+				     else endDay + 1
+			first = snapshots[d].shiftConfigIndex
+			index.extend((first + k) % nrShiftConfigs
+				     for k in range(segmentEnd - d))
+		items = [ shiftConfig[i] for i in index ]
+
+		dayType = [ DTYPE_DEFAULT if t is None else t
+			    for t in days.dayType ]
+		shift = [ i.shift if s is None else s
+			  for (s, i) in zip(days.shift, items) ]
+		workTime = [ i.workTime if t is None else t
+			     for (t, i) in zip(days.workTime, items) ]
+		breakTime = [ i.breakTime if t is None else t
+			      for (t, i) in zip(days.breakTime, items) ]
+		attendanceTime = [ i.attendanceTime if t is None else t
+				   for (t, i) in zip(days.attendanceTime, items) ]
+
+		# Hours worked on normal days.
+		worked = [ (a - b) if (t == DTYPE_DEFAULT and a > 0.001) else 0.0
+			   for (t, a, b) in zip(dayType, attendanceTime, breakTime) ]
+		# Account and holiday changes per day.
+		delta = [ (a - w - b) if (t == DTYPE_DEFAULT and a > 0.001) else\
+			  (-w if t == DTYPE_COMPTIME else 0.0)
+			  for (t, a, w, b) in zip(dayType, attendanceTime,
+						  workTime, breakTime) ]
+		holidayDelta = [ -1 if t == DTYPE_HOLIDAY else 0
+				 for t in dayType ]
+
+		# Cumulative sums. Every snapshot restarts the sum.
+		account = array.array("d")
+		holidays = array.array("l")
+		for (i, d) in enumerate(segmentDays):
+			a = d - loadDay
+			b = (segmentDays[i + 1] - loadDay) if i + 1 < len(segmentDays)\
+			    else days.nrDays
+			s = snapshots[d]
+			account.extend(itertools.accumulate(
+				itertools.chain((s.accountValue,), delta[a:b])))
+			del account[a]
+			holidays.extend(itertools.accumulate(
+				itertools.chain((s.holidaysLeft,), holidayDelta[a:b])))
+			del holidays[a]
+
+		report = AccountReport(beginDate, endDay - beginDay + 1)
+		first = beginDay - loadDay
+		report.shiftConfigIndex = array.array("l", index[first:])
+		report.dayType = dayType[first:]
+		report.shift = shift[first:]
+		report.workTime = array.array("d", workTime[first:])
+		report.breakTime = array.array("d", breakTime[first:])
+		report.attendanceTime = array.array("d", attendanceTime[first:])
+		report.worked = array.array("d", worked[first:])
+		report.delta = array.array("d", delta[first:])
+		report.account = account[first:]
+		report.holidays = holidays[first:]
+		return report
+
+DTYPE_NAMES = {
+	DTYPE_DEFAULT		: "default",
+	DTYPE_COMPTIME		: "comptime",
+	DTYPE_HOLIDAY		: "holiday",
+	DTYPE_FEASTDAY		: "feastday",
+	DTYPE_SHORTTIME		: "shorttime",
+}
+
+SHIFT_NAMES = {
+	SHIFT_EARLY		: "early",
+	SHIFT_LATE		: "late",
+	SHIFT_NIGHT		: "night",
+	SHIFT_DAY		: "day",
+}
+
+class AccountReport(object):
+	"""Daily account report of a date interval.
+	All columns are parallel arrays indexed by the day offset
+	from beginDate. The account and holiday columns hold
+	the state at the end of the day."""
+
+	__slots__ = ( "beginDate", "beginDay", "nrDays",
+		      "shiftConfigIndex", "dayType", "shift",
+		      "workTime", "breakTime", "attendanceTime",
+		      "worked", "delta", "account", "holidays", )
+
+	COLUMNS = ( "dayType", "shift", "workTime", "breakTime",
+		    "attendanceTime", "worked", "delta", "account",
+		    "holidays", )
+
+	def __init__(self, beginDate, nrDays):
+		self.beginDate = beginDate
+		self.beginDay = dateToDay(beginDate)
+		self.nrDays = nrDays
+
+	def getDate(self, offset):
+		return dayToDate(self.beginDay + offset)
+
+	def getShiftSummary(self):
+		"""Returns a dict: shift -> (nrDaysWorked, hoursWorked)."""
+		summary = {}
+		for (shift, worked) in zip(self.shift, self.worked):
+			if worked:
+				nrDays, hours = summary.get(shift, (0, 0.0))
+				summary[shift] = (nrDays + 1, hours + worked)
+		return summary
+
+	def __rows(self):
+		for (offset, row) in enumerate(zip(*(getattr(self, c)
+						     for c in self.COLUMNS))):
+			dtype, shift = row[0], row[1]
+			yield (pyDayToDate(self.beginDay + offset).isoformat(),
+			       DTYPE_NAMES.get(dtype, str(dtype)),
+			       SHIFT_NAMES.get(shift, str(shift))) + row[2:]
+
+	def writeText(self, fd):
+		fd.write("date\tdaytype\tshift\twork\tbreak\tattendance"
+			 "\tworked\tdelta\taccount\tholidays\n")
+		for row in self.__rows():
+			fd.write("%s\t%s\t%s\t%.2f\t%.2f\t%.2f\t%.2f\t%.2f\t%.2f\t%d\n" % row)
+
+	def writeCSV(self, fd):
+		import csv
+		w = csv.writer(fd)
+		w.writerow(("date",) + self.COLUMNS)
+		w.writerows(self.__rows())
+
+	def writeJSON(self, fd):
+		import json
+		data = {
+			"begin"		: formatDate(self.beginDate),
+			"end"		: formatDate(self.getDate(self.nrDays - 1)),
+			"days"		: [ dict(zip(("date",) + self.COLUMNS, row))
+					    for row in self.__rows() ],
+			"shifts"	: { SHIFT_NAMES.get(shift, str(shift)) :
+					    { "days" : nrDays, "hours" : hours }
+					    for (shift, (nrDays, hours))
+					    in self.getShiftSummary().items() },
+		}
+		json.dump(data, fd, indent=1)
+		fd.write("\n")
+
+	def write(self, fd, fmt):
+		try:
+			writer = { "text"	: self.writeText,
+				   "csv"	: self.writeCSV,
+				   "json"	: self.writeJSON, }[fmt]
+		except KeyError as e:
+			raise TsException("Unknown report format '%s'" % fmt)
+		writer(fd)
+
+def cmdBalance(db, args, opts):
+	if len(args) > 1:
+		raise TsException("Too many arguments")
+	date = parseDate(args[0]) if args else dayToDate(dateToDay(datetime.date.today()))
+	state = AccountEngine(db).calcAccountStateForDate(date)
+	if state is None:
+		raise TsException("No shift configuration or no snapshot "
+				  "before %s" % formatDate(date))
+	print("%s:  %.1f h -> %.1f h  holidays: %d d" %\
+	      (formatDate(date),
+	       round(state.accountAtStartOfDay, 1),
+	       round(state.accountAtEndOfDay, 1),
+	       state.holidaysAtEndOfDay))
+
+def writeReport(account, beginDate, endDate, filename, fmt):
+	"""Write the account report of 'account' (an AccountEngine)
+	to the file 'filename' or to stdout."""
+	if fmt is None:
+		fmt = "text"
+		if filename:
+			fmt = "json" if filename.lower().endswith(".json") else "csv"
+	report = account.calcReport(beginDate, endDate)
+	try:
+		fd = open(filename, "w", newline="") if filename else sys.stdout
+		try:
+			report.write(fd, fmt)
+		finally:
+			if fd is not sys.stdout:
+				fd.close()
+	except IOError as e:
+		raise TsException("Failed to write '%s': %s" %\
+				  (filename, e.strerror))
+
+def cmdReport(db, args, opts):
+	if len(args) not in (2, 3):
+		raise TsException("report needs BEGIN and END dates")
+	writeReport(AccountEngine(db), parseDate(args[0]), parseDate(args[1]),
+		    args[2] if len(args) > 2 else None, opts["format"])
+
+def cmdYear(db, args, opts):
+	if len(args) not in (1, 2):
+		raise TsException("year needs a YEAR")
+	try:
+		year = int(args[0])
+		beginDate = dayToDate(dateToDay(datetime.date(year, 1, 1)))
+		endDate = dayToDate(dateToDay(datetime.date(year, 12, 31)))
+	except ValueError as e:
+		raise TsException("Invalid year '%s'" % args[0])
+	writeReport(AccountEngine(db), beginDate, endDate,
+		    args[1] if len(args) > 1 else None, opts["format"])
+
+def cmdExport(db, args, opts):
+	import csv
+	if len(args) not in (2, 3):
+		raise TsException("export needs BEGIN and END dates")
+	beginDate, endDate = parseDate(args[0]), parseDate(args[1])
+	days = db.loadRange(beginDate, endDate)
+	filename = args[2] if len(args) > 2 else None
+	try:
+		fd = open(filename, "w", newline="") if filename else sys.stdout
+		try:
+			w = csv.writer(fd)
+			w.writerow(("date", "dayType", "shift", "workTime", "breakTime",
+				    "attendanceTime", "dayFlags", "comment", "snapshot"))
+			for offset in range(days.nrDays):
+				w.writerow((formatDate(days.getDate(offset)),
+					    "" if days.dayType[offset] is None else days.dayType[offset],
+					    "" if days.shift[offset] is None else days.shift[offset],
+					    "" if days.workTime[offset] is None else days.workTime[offset],
+					    "" if days.breakTime[offset] is None else days.breakTime[offset],
+					    "" if days.attendanceTime[offset] is None else days.attendanceTime[offset],
+					    days.dayFlags[offset],
+					    db.getComment(days.getDate(offset)) or ""
+						if days.hasComment[offset] else "",
+					    days.hasSnapshot[offset]))
+		finally:
+			if fd is not sys.stdout:
+				fd.close()
+	except IOError as e:
+		raise TsException("Failed to write '%s': %s" %\
+				  (filename, e.strerror))
+
+def cmdIcalExport(db, args, opts):
+	import tsical
+	if len(args) not in (2, 3):
+		raise TsException("ical-export needs BEGIN and END dates")
+	beginDate, endDate = parseDate(args[0]), parseDate(args[1])
+	try:
+		fd = open(args[2], "w", encoding="UTF-8", newline="")\
+		     if len(args) > 2 else sys.stdout
+		try:
+			nrEvents = tsical.ICalExport(db).exportICal(fd, beginDate, endDate)
+		finally:
+			if fd is not sys.stdout:
+				fd.close()
+	except IOError as e:
+		raise TsException("Failed to write '%s': %s" %\
+				  (args[2], e.strerror))
+	printInfo("Exported %d events." % nrEvents)
+
+def cmdSync(db, args, opts):
+	if len(args) != 1:
+		raise TsException("sync needs the PEER database file")
+	try:
+		open(args[0], "rb").close()
+	except IOError as e:
+		raise TsException("Failed to open '%s': %s" %\
+				  (args[0], e.strerror))
+	peer = TsDatabase()
+	try:
+		peer.open(args[0], opts["profile"])
+		toDb, toPeer = syncDatabases(db, peer)
+	finally:
+		peer.close()
+	printInfo("Received %d and sent %d changes." % (toDb, toPeer))
+
+def cmdNewId(db, args, opts):
+	printInfo("New database ID: %s" % db.newDatabaseId())
+
+def usage():
+	print("Usage: tscore.py [OPTIONS] DATABASE COMMAND [ARGS]")
+	print("")
+	print("Commands:")
+	print(" balance [DATE]             Account state at DATE (default: today)")
+	print(" report BEGIN END [FILE]    Daily account report")
+	print(" year YEAR [FILE]           Daily account report of a whole year")
+	print(" export BEGIN END [FILE]    Export the day data as CSV")
+	print(" ical-export BEGIN END [FILE]")
+	print("                            Export day types, shifts and comments as iCalendar")
+	print(" sync PEER                  Exchange the changes since the last sync with")
+	print("                            the database file PEER. The newer change wins.")
+	print("                            Both databases must be clones of a common one.")
+	print(" new-id                     Assign a new sync ID. Needed once for plain")
+	print("                            file copies of a database.")
+	print("")
+	print("Dates are in YYYY-MM-DD format.")
+	print("")
+	print("Options:")
+	print(" -p|--profile PROFILE       Database profile: fast (default) or safe")
+	print(" -f|--format FORMAT         Report format: text, csv or json")
+	print("                            Default: text on stdout, else by FILE suffix")
+	print(" -S|--sqlstats              Print SQL statement statistics to stderr")
+	print(" -h|--help                  Show this help text")
+
+def main(argv):
+	import getopt
+
+	opt_profile = TsDatabase.DEFAULT_PROFILE
+	opt_format = None
+	opt_sqlStats = False
+	try:
+		(opts, args) = getopt.getopt(argv[1:],
+			"hp:f:S",
+			[ "help", "profile=", "format=", "sqlstats", ])
+		for (o, v) in opts:
+			if o in ("-h", "--help"):
+				usage()
+				return 0
+			if o in ("-p", "--profile"):
+				opt_profile = v
+			if o in ("-f", "--format"):
+				opt_format = v
+			if o in ("-S", "--sqlstats"):
+				opt_sqlStats = True
+	except getopt.GetoptError as e:
+		usage()
+		return 1
+	if len(args) < 2:
+		usage()
+		return 1
+	filename, command, args = args[0], args[1], args[2:]
+	commands = {
+		"balance"	: cmdBalance,
+		"report"	: cmdReport,
+		"year"		: cmdYear,
+		"export"	: cmdExport,
+		"ical-export"	: cmdIcalExport,
+		"sync"		: cmdSync,
+		"new-id"	: cmdNewId,
+	}
+	if command not in commands:
+		usage()
+		return 1
+	# Check the profile before the database file is opened and modified.
+	if opt_profile not in TsDatabase.PROFILES:
+		printInfo("Unknown database profile '%s'" % opt_profile)
+		return 1
+	db = TsDatabase()
+	db.enableStats(opt_sqlStats)
+	try:
+		try:
+			open(filename, "rb").close()
+		except IOError as e:
+			raise TsException("Failed to open '%s': %s" %\
+					  (filename, e.strerror))
+		db.open(filename, opt_profile)
+		with db.operation(command):
+			commands[command](db, args, { "format" : opt_format,
+						      "profile" : opt_profile, })
+	except TsException as e:
+		printInfo(str(e))
+		return 1
+	finally:
+		db.close()
+		if db.stats:
+			db.stats.dump()
+	return 0
+
+if __name__ == "__main__":
+	# Run main() of the 'tscore' module. Modules importing tscore
+	# must see the same classes (e.g. TsException) as the command.
+	import tscore
+	sys.exit(tscore.main(sys.argv))
@@ -0,0 +1,563 @@
+"""
+# timeshift - Simple work time scheduler
+# iCalendar import and export
+# Copyright (c) 2009-2020 Michael Buesch <m@bues.ch>
+# Licensed under the GNU/GPL version 2 or later.
+"""
+
+import io
+import re
+import datetime
+
+# tscore.registerDateType() replaces tscore.dayToDate.
+# Always call it through the module.
+import tscore
+from tscore import *
+
+
+class ICal_Event(object):
+	__slots__ = ( "props", )
+
+	def __init__(self):
+		self.props = { }
+
+	def addProp(self, prop):
+		self.props[prop.name] = prop
+
+	def getProp(self, name):
+		try:
+			return self.props[name]
+		except KeyError as e:
+			return None
+
+	def iterDates(self):
+		"""Yields the date objects of all days covered by the event
+		and its recurrences, one at a time."""
+		start = self.getProp("DTSTART")
+		if not start:
+			raise TsException("No DTSTART property")
+		startDay, startSecs = start.toDayTime()
+		nrDays = self.__getNrDays(startDay, startSecs)
+		rrule = self.getProp("RRULE")
+		if rrule:
+			occurrences = ICal_RRule(rrule.value).iterDays(startDay)
+		else:
+			occurrences = (startDay, )
+		for day in occurrences:
+			for i in range(nrDays):
+				yield tscore.dayToDate(day + i)
+
+	def __getNrDays(self, startDay, startSecs):
+		# Get the number of days covered by one occurrence.
+		end = self.getProp("DTEND")
+		if end:
+			endDay = end.toDayTime()[0]
+		else:
+			dur = self.getProp("DURATION")
+			if not dur:
+				return 1
+			secs = dur.toSeconds()
+			if startSecs is None:
+				# All-day event. Only whole days count.
+				return max(secs // 86400, 1)
+			endDay = startDay + (startSecs + secs) // 86400
+		# The end date is exclusive, also for timed events.
+		# A night shift that ends on the next morning only
+		# covers its start day.
+		return max(endDay - startDay, 1)
+
+class ICal_Prop(object):
+	__slots__ = ( "name", "params", "value", )
+
+	def __init__(self, name, params, value):
+		self.name = name
+		self.params = params
+		self.value = value
+
+	def toDayTime(self):
+		# Parse a DATE or DATE-TIME value.
+		# Returns a tuple (dayNumber, secondsOfDay).
+		# secondsOfDay is None for DATE values.
+		value = self.value.strip().replace("-", "").replace(":", "")
+		if (len(value) == 8 or value[8:9] == "T") and value[:8].isdigit():
+			try:
+				day = dateToDay(datetime.date(int(value[0:4]),
+							      int(value[4:6]),
+							      int(value[6:8])))
+				if len(value) == 8:
+					return day, None
+				time = value[9:15]
+				if len(time) == 6 and time.isdigit():
+					return day, (int(time[0:2]) * 3600 +
+						     int(time[2:4]) * 60 +
+						     int(time[4:6]))
+			except ValueError as e:
+				pass
+		raise TsException("Date property '%s' "
+			"format error" % self.name)
+
+	def toDate(self):
+		return tscore.dayToDate(self.toDayTime()[0])
+
+	def toText(self):
+		# Unescape a TEXT value.
+		return re.sub(r"\\([\\;,nN])",
+			      lambda m: "\n" if m.group(1) in "nN" else m.group(1),
+			      self.value)
+
+	def toSeconds(self):
+		# Parse a DURATION value.
+		value = self.value.strip().upper()
+		m = re.match(r"^\+?P(?:(\d+)W)?(?:(\d+)D)?"
+			     r"(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$",
+			     value)
+		if not m or value.endswith(("P", "T")):
+			raise TsException("Duration property '%s' "
+				"format error" % self.name)
+		w, d, h, mi, s = (int(v or 0) for v in m.groups())
+		return (((w * 7 + d) * 24 + h) * 60 + mi) * 60 + s
+
+class ICal_RRule(object):
+	"""Recurrence rule (RRULE) expansion.
+	Supports FREQ=DAILY/WEEKLY/MONTHLY with INTERVAL, COUNT,
+	UNTIL and BYDAY."""
+
+	__slots__ = ( "freq", "interval", "count", "untilDay", "byDay", )
+
+	WEEKDAYS = ( "MO", "TU", "WE", "TH", "FR", "SA", "SU", )
+
+	# Rules without COUNT and UNTIL are expanded this many days.
+	UNBOUNDED_DAYS = 366 * 5
+	# No rule is expanded further than this many days.
+	MAX_DAYS = 366 * 100
+
+	def __init__(self, value):
+		self.freq = None
+		self.interval = 1
+		self.count = None
+		self.untilDay = None
+		self.byDay = [] # List of (ordinal, weekday). Ordinal 0: every.
+		try:
+			for part in value.strip().split(";"):
+				name, sep, val = part.partition("=")
+				name = name.strip().upper()
+				val = val.strip().upper()
+				if name == "FREQ":
+					self.freq = val
+				elif name == "INTERVAL":
+					self.interval = int(val)
+				elif name == "COUNT":
+					self.count = int(val)
+				elif name == "UNTIL":
+					self.untilDay, secs = ICal_Prop(name, [], val).toDayTime()
+				elif name == "BYDAY":
+					for wd in val.split(","):
+						wd = wd.strip()
+						self.byDay.append((int(wd[:-2] or 0),
+								   self.WEEKDAYS.index(wd[-2:])))
+				elif name == "WKST":
+					pass # Weeks always start on Monday.
+				else:
+					raise TsException("RRULE part '%s' "
+						"not supported" % name)
+		except ValueError as e:
+			raise TsException("Invalid RRULE '%s'" % value)
+		if self.freq not in ("DAILY", "WEEKLY", "MONTHLY"):
+			raise TsException("RRULE FREQ=%s not supported" % self.freq)
+		if self.interval < 1:
+			raise TsException("Invalid RRULE INTERVAL")
+		if self.freq != "MONTHLY" and any(o for (o, wd) in self.byDay):
+			raise TsException("RRULE BYDAY ordinals need FREQ=MONTHLY")
+
+	@staticmethod
+	def weekday(day):
+		# Monday = 0. Day number 0 is a Monday.
+		return day % 7
+
+	def iterDays(self, startDay):
+		"""Yields the start day numbers of all occurrences."""
+		lastDay = startDay + self.MAX_DAYS
+		if self.untilDay is not None:
+			lastDay = min(lastDay, self.untilDay)
+		elif self.count is None:
+			lastDay = startDay + self.UNBOUNDED_DAYS
+			printInfo("ical: Unbounded RRULE. "
+				  "Expanding %d days." % self.UNBOUNDED_DAYS)
+		iterFreq = { "DAILY"	: self.__iterDaily,
+			     "WEEKLY"	: self.__iterWeekly,
+			     "MONTHLY"	: self.__iterMonthly, }[self.freq]
+		count = 0
+		for day in iterFreq(startDay, lastDay):
+			if day < startDay:
+				continue
+			if day > lastDay:
+				break
+			yield day
+			count += 1
+			if self.count is not None and count >= self.count:
+				break
+
+	def __iterDaily(self, startDay, lastDay):
+		weekdays = { wd for (o, wd) in self.byDay }
+		day = startDay
+		while day <= lastDay:
+			if not weekdays or self.weekday(day) in weekdays:
+				yield day
+			day += self.interval
+
+	def __iterWeekly(self, startDay, lastDay):
+		weekdays = sorted({ wd for (o, wd) in self.byDay } or
+				  { self.weekday(startDay) })
+		weekStart = startDay - self.weekday(startDay)
+		while weekStart <= lastDay:
+			for wd in weekdays:
+				yield weekStart + wd
+			weekStart += 7 * self.interval
+
+	def __iterMonthly(self, startDay, lastDay):
+		start = pyDayToDate(startDay)
+		year, month = start.year, start.month
+		while True:
+			first = dateToDay(datetime.date(year, month, 1))
+			if first > lastDay:
+				break
+			nrDays = (datetime.date(year + month // 12, month % 12 + 1, 1) -
+				  datetime.date(year, month, 1)).days
+			if self.byDay:
+				days = set()
+				for (ordinal, wd) in self.byDay:
+					matches = range(first + (wd - self.weekday(first)) % 7,
+							first + nrDays, 7)
+					if ordinal == 0:
+						days.update(matches)
+					elif 1 <= abs(ordinal) <= len(matches):
+						days.add(matches[ordinal - 1 if ordinal > 0
+								 else ordinal])
+				yield from sorted(days)
+			elif start.day <= nrDays:
+				# Months without that day are skipped.
+				yield first + start.day - 1
+			month += self.interval
+			year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+
+def unfoldLines(fd):
+	"""Read the lines of the text file object 'fd' and unfold
+	RFC 5545 folded lines. A physical line starting with a space
+	or tab continues the previous line.
+	Yields the unfolded logical lines."""
+	line = None
+	# The file object reads buffered chunks.
+	# Only one logical line is kept in memory.
+	for physLine in fd:
+		physLine = physLine.rstrip("\r\n")
+		if physLine[:1] in (" ", "\t"):
+			if line is not None:
+				line += physLine[1:]
+			continue
+		if line is not None:
+			yield line
+		line = physLine
+	if line is not None:
+		yield line
+
+class ICal(object):
+	"Simple streaming iCalendar parser"
+
+	def __parseParams(self, params):
+		# Returns a list of tuples: (paramName, paramValue)
+		ret = []
+		for param in params:
+			p = param.split('=', 1)
+			if len(p) != 2:
+				raise TsException("Invalid parameter '%s'" % param)
+			p[0] = p[0].upper()
+			ret.append(tuple(p))
+		return ret
+
+	@staticmethod
+	def __splitLine(line):
+		# Split a content line into the name (with parameters)
+		# and the value. Colons in quoted parameters are ignored.
+		if '"' not in line:
+			name, sep, value = line.partition(':')
+			return name, value
+		quoted = False
+		for i, c in enumerate(line):
+			if c == '"':
+				quoted = not quoted
+			elif c == ':' and not quoted:
+				return line[:i], line[i+1:]
+		return line, ""
+
+	def __unknown(self, propName, value):
+		printInfo("ical: Ignoring unexpected '%s:%s'" %\
+			  (propName, value))
+
+	def iterEvents(self, fd):
+		"""Parse the iCalendar file object 'fd'.
+		A binary file object is decoded as UTF-8.
+		Yields the ICal_Event objects one by one."""
+		if not isinstance(fd, io.TextIOBase):
+			fd = io.TextIOWrapper(fd, encoding="UTF-8")
+		inCalendar = False
+		curEvent = None
+		try:
+			for line in unfoldLines(fd):
+				if not line.strip():
+					continue
+				name, value = self.__splitLine(line)
+				prop = name.split(';')
+				propName = prop[0].strip().upper()
+				propParams = self.__parseParams(prop[1:])
+				if not inCalendar:
+					if propName == "BEGIN" and\
+					   value.strip().upper() == "VCALENDAR":
+						inCalendar = True
+						continue
+					self.__unknown(propName, value)
+					continue
+				if not curEvent:
+					if propName in ("METHOD", "PRODID", "VERSION"):
+						continue
+					if propName == "BEGIN" and\
+					   value.strip().upper() == "VEVENT":
+						curEvent = ICal_Event()
+						continue
+					if propName == "END" and\
+					   value.strip().upper() == "VCALENDAR":
+						curEvent = None
+						inCalendar = False
+						continue
+					self.__unknown(propName, value)
+					continue
+				if propName == "END" and\
+				   value.strip().upper() == "VEVENT":
+					yield curEvent
+					curEvent = None
+					continue
+				curEvent.addProp(ICal_Prop(propName, propParams, value))
+		except UnicodeError as e:
+			raise TsException("iCalendar decoding failed: " + str(e))
+
+class ICalImport_Opts(object):
+	__slots__ = ( "setShift", "setDayType", )
+
+	def __init__(self, setShift, setDayType):
+		self.setShift = setShift
+		self.setDayType = setDayType
+
+class ICalImport(ICal):
+	"""Import iCalendar events into a TsDatabase.
+	The new values are collected and written in chunks of
+	FLUSH_DAYS days. The whole import is one transaction."""
+
+	FLUSH_DAYS = 1024
+
+	def __init__(self, db, question=None):
+		ICal.__init__(self)
+		self.db = db
+		self.questionCallback = question
+
+	def question(self, date, caption, text):
+		"""Ask whether existing data shall be overridden.
+		Returns True for yes. May raise TsException to cancel.
+		Calls the 'question' callback, if there is one.
+		Otherwise the existing data is kept."""
+		if self.questionCallback:
+			return self.questionCallback(date, caption, text)
+		return False
+
+	def importICal(self, fd, opts):
+		# Pending new values: dayNumber -> (date, value)
+		self.__dayTypes = {}
+		self.__shifts = {}
+		self.__comments = {}
+		with self.db.batch():
+			for event in self.iterEvents(fd):
+				summary = event.getProp("SUMMARY")
+				if not summary:
+					raise TsException(
+						"Event does not have SUMMARY attribute")
+				eventOpts, comment = self.__getEventData(event, opts)
+				for date in event.iterDates():
+					self.__doImport(comment, date, eventOpts)
+					if len(self.__dayTypes) + len(self.__shifts) +\
+					   len(self.__comments) >= self.FLUSH_DAYS:
+						self.__flush()
+			self.__flush()
+
+	@staticmethod
+	def __getEventData(event, opts):
+		# Returns the options and the comment for the event.
+		# Events exported by ICalExport carry their own day type,
+		# shift and comment. The day type and shift are used,
+		# if the options don't set them.
+		names = ( "X-TIMESHIFT-DAYTYPE", "X-TIMESHIFT-SHIFT",
+			  "X-TIMESHIFT-COMMENT", )
+		dtype, shift, comment = (event.getProp(n) for n in names)
+		if not (dtype or shift or comment):
+			return opts, event.getProp("SUMMARY").toText()
+		setDayType, setShift = opts.setDayType, opts.setShift
+		try:
+			if dtype and setDayType == DTYPE_DEFAULT:
+				setDayType = int(dtype.value)
+			if shift and setShift == SHIFT_DEFAULT:
+				setShift = int(shift.value)
+		except ValueError as e:
+			raise TsException("Invalid X-TIMESHIFT property")
+		return (ICalImport_Opts(setShift, setDayType),
+			comment.toText() if comment else None)
+
+	def __flush(self):
+		self.db.setDayTypeOverrides(self.__dayTypes.values())
+		self.db.setShiftOverrides(self.__shifts.values())
+		self.db.setComments(self.__comments.values())
+		self.__dayTypes.clear()
+		self.__shifts.clear()
+		self.__comments.clear()
+
+	def __doImport(self, comment, date, opts):
+		day = dateToDay(date)
+		if opts.setDayType != DTYPE_DEFAULT:
+			newDType = opts.setDayType
+			curDType = self.__dayTypes[day][1] if day in self.__dayTypes\
+				   else self.db.getDayTypeOverride(date)
+			if curDType is not None and\
+			   curDType != newDType:
+				yes = self.question(date,
+					"Has day-type override",
+					formatDate(date) + ": "
+					"Already has day type. Override?")
+				if not yes:
+					newDType = curDType
+			if curDType != newDType:
+				self.__dayTypes[day] = (date, newDType)
+		if opts.setShift != SHIFT_DEFAULT:
+			newShift = opts.setShift
+			curShift = self.__shifts[day][1] if day in self.__shifts\
+				   else self.db.getShiftOverride(date)
+			if curShift is not None and\
+			   curShift != newShift:
+				yes = self.question(date,
+					"Has shift override",
+					formatDate(date) + ": "
+					"Already has shift. Override?")
+				if not yes:
+					newShift = curShift
+			if curShift != newShift:
+				self.__shifts[day] = (date, newShift)
+		if comment is None:
+			return
+		newComment = comment
+		if day in self.__comments:
+			curComment = self.__comments[day][1]
+		else:
+			curComment = self.db.getComment(date)\
+				     if self.db.hasComment(date) else None
+		if curComment and\
+		   curComment != newComment:
+			yes = self.question(date, "Comment exists",
+				"A comment exists:\n'" + curComment +\
+				"'\n\nAppend '%s'?" % comment)
+			if yes:
+				newComment = curComment + '\n' + comment
+			else:
+				newComment = curComment
+		if curComment != newComment:
+			self.__comments[day] = (date, newComment)
+
+class ICalExport(object):
+	"""Export day types, shift overrides and comments
+	as iCalendar all-day events. Runs of adjacent days with
+	identical data are written as one multi-day event."""
+
+	TABLES = ( "override_dayType", "override_shift", "comments", )
+
+	DTYPE_NAMES = {
+		DTYPE_COMPTIME		: "Zeitausgleich",
+		DTYPE_HOLIDAY		: "Urlaub",
+		DTYPE_FEASTDAY		: "Feiertag",
+		DTYPE_SHORTTIME		: "Kurzarbeit",
+	}
+
+	SHIFT_NAMES = {
+		SHIFT_EARLY		: "Fruehschicht",
+		SHIFT_LATE		: "Spaetschicht",
+		SHIFT_NIGHT		: "Nachtschicht",
+		SHIFT_DAY		: "Normalschicht",
+	}
+
+	def __init__(self, db):
+		self.db = db
+
+	@staticmethod
+	def __escape(text):
+		return text.replace("\\", "\\\\").replace(";", "\\;")\
+			   .replace(",", "\\,").replace("\n", "\\n")
+
+	@staticmethod
+	def __writeLine(fd, line):
+		# Fold the line into chunks of at most 75 octets.
+		# Multi-byte UTF-8 characters are not split.
+		if len(line) <= 75 and len(line.encode("UTF-8")) <= 75:
+			fd.write(line + "\r\n")
+			return
+		first = True
+		while True:
+			size, end = 0 if first else 1, 0
+			while end < len(line):
+				size += len(line[end].encode("UTF-8"))
+				if size > 75:
+					break
+				end += 1
+			fd.write(("" if first else " ") + line[:end] + "\r\n")
+			line, first = line[end:], False
+			if not line:
+				break
+
+	def exportICal(self, fd, beginDate, endDate):
+		"""Write the iCalendar to the text file object 'fd'.
+		Returns the number of events written."""
+		self.__stamp = datetime.datetime.now(datetime.timezone.utc).strftime(
+			"%Y%m%dT%H%M%SZ")
+		for line in ("BEGIN:VCALENDAR",
+			     "VERSION:2.0",
+			     "PRODID:-//bues.ch//timeshift//DE"):
+			self.__writeLine(fd, line)
+		nrEvents, run = 0, None
+		for (day, values) in self.db.iterDayValues(self.TABLES,
+							   beginDate, endDate):
+			if run and day == run[1] + 1 and values == run[2]:
+				run[1] = day
+				continue
+			if run:
+				self.__writeEvent(fd, *run)
+				nrEvents += 1
+			run = [ day, day, values ]
+		if run:
+			self.__writeEvent(fd, *run)
+			nrEvents += 1
+		self.__writeLine(fd, "END:VCALENDAR")
+		return nrEvents
+
+	def __writeEvent(self, fd, firstDay, lastDay, values):
+		dtype, shift, comment = values
+		names = [ self.DTYPE_NAMES.get(dtype), self.SHIFT_NAMES.get(shift) ]
+		summary = comment or ", ".join(n for n in names if n)
+		start = pyDayToDate(firstDay).strftime("%Y%m%d")
+		lines = [ "BEGIN:VEVENT",
+			  "UID:%s-%d@timeshift" % (start, lastDay - firstDay + 1),
+			  "DTSTAMP:" + self.__stamp,
+			  "DTSTART;VALUE=DATE:" + start,
+			  "DTEND;VALUE=DATE:" +\
+			  pyDayToDate(lastDay + 1).strftime("%Y%m%d"),
+			  "SUMMARY:" + self.__escape(summary or "---"), ]
+		if dtype is not None:
+			lines.append("X-TIMESHIFT-DAYTYPE:%d" % dtype)
+		if shift is not None:
+			lines.append("X-TIMESHIFT-SHIFT:%d" % shift)
+		if comment:
+			lines.append("X-TIMESHIFT-COMMENT:" + self.__escape(comment))
+		lines.append("END:VEVENT")
+		for line in lines:
+			self.__writeLine(fd, line)